@@ -1,9 +1,12 @@
-import base64
-import requests
+import io
 import json
+import hashlib
 import os
 import argparse
 import re
+from ado_client import AzureDevOpsClient, ThreadStateStore
+from instrumentation import load_report, timing_table
+from risk import RISK_LEVELS, RiskScorer
 
 def strip_ansi_codes(text):
     """Remove ANSI color/style codes from text"""
@@ -11,55 +14,389 @@ def strip_ansi_codes(text):
     ansi_pattern = re.compile(r'(\x1B|\033)?\[[0-9;]*[mGKHfJ]')
     return ansi_pattern.sub('', text)
 
-def generate_auth_header(token):
-    return {
-        'Authorization': f'Basic {base64.b64encode(token.encode()).decode()}',
-        'Content-Type': 'application/json'
-    }
+# Emoji shown in the change list for each action
+ACTION_EMOJI = {
+    "create": "➕",
+    "update": "🔄",
+    "replace": "♻️",
+    "delete": "❌"
+}
+
+# Terraform plan prefixes in the filtered text output
+PREFIX_ACTIONS = {
+    "+": "create",
+    "~": "update",
+    "-/+": "replace",
+    "-": "delete"
+}
 
-def determine_risk_level(file_content):
-    """Determine risk level based on the number and type of changes"""
-    # Count resources being added, changed, destroyed
-    to_add = len(re.findall(r'will be created', file_content))
-    to_change = len(re.findall(r'will be updated', file_content))
-    to_destroy = len(re.findall(r'will be destroyed', file_content))
-    to_replace = len(re.findall(r'must be replaced', file_content))
+def load_plan_summary(base_name):
+    """Load the {base_name}_summary.json written by tfplan.py, if there is one"""
+    try:
+        with open(f"{base_name}_summary.json", 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def parse_changes_from_text(file_content):
+    """Recover (action, address) pairs from filtered plan text without a summary file"""
+    changes = []
     
-    # Calculate risk level
-    if to_destroy > 5 or to_replace > 5:
-        return "HIGH", "🔴", 4, to_add, to_change, to_destroy, to_replace
-    elif to_destroy > 0 or to_replace > 0 or to_change > 10:
-        return "MEDIUM", "🟠", 3, to_add, to_change, to_destroy, to_replace
-    elif to_change > 0 or to_add > 10:
-        return "LOW", "🟡", 2, to_add, to_change, to_destroy, to_replace
-    elif to_add > 0:
-        return "MINIMAL", "🟢", 1, to_add, to_change, to_destroy, to_replace
-    else:
-        return "NONE", "✅", 0, to_add, to_change, to_destroy, to_replace
+    # Look for resources being changed in the filtered output
+    resource_pattern = r'([~\-+/]+)\s+(.+)'
+    resource_matches = re.findall(resource_pattern, file_content)
+    
+    for prefix, resource_name in resource_matches:
+        # Only count actual resources, not attributes
+        if not resource_name.strip().startswith('~') and '=' not in resource_name and prefix in PREFIX_ACTIONS:
+            changes.append((PREFIX_ACTIONS[prefix], resource_name.strip()))
+    
+    return changes
 
 def get_risk_badge(risk_level):
     """Return markdown for a risk badge based on risk level"""
-    emoji_map = {
-        "HIGH": "🔴",
-        "MEDIUM": "🟠",
-        "LOW": "🟡",
-        "MINIMAL": "🟢",
-        "NONE": "✅"
-    }
+    return f'{RISK_LEVELS[risk_level][0]} **{risk_level}**'
+
+# Risk reasons listed under a section's change list
+MAX_RISK_REASONS = 5
+
+# Loaded once from RISK_WEIGHTS_FILE or configurations/risk_weights.json
+risk_scorer = RiskScorer.load()
+
+# Detail levels a file section can be rendered at, from most to least verbose
+DETAIL_FULL, DETAIL_CHANGES, DETAIL_MINIMAL = 0, 1, 2
+
+DEFAULT_COMMENT_SIZE_LIMIT = 150000
+DEFAULT_MAX_COMMENTS = 5
+
+CONTINUATION_HEADING = "# 🔍 Terraform Plan Details"
+
+def continuation_heading(part, parts):
+    return f"{CONTINUATION_HEADING} (part {part}/{parts})\n"
+
+def continued_note(parts):
+    return f"\n\n*Continued in {parts - 1} more comment(s).*"
+
+def render_section(summary, level, max_content=None):
+    """Render the detailed section of one plan file at the given detail level"""
+    out = io.StringIO()
+    out.write(f"\n<a id='file-{summary['item'].replace('.', '').lower()}'></a>\n\n")
+    out.write(f"## {summary['risk_emoji']} {summary['file_name']}\n")
+    
+    # Show the list of changes if there are any
+    if summary['changes'] and level < DETAIL_MINIMAL:
+        out.write("\n**Changes:**\n")
+        for action, address in summary['changes']:
+            # Format with appropriate emoji based on the change type
+            out.write(f"- {ACTION_EMOJI[action]} {address}\n")
+        out.write("\n")
+    
+    if summary.get('risk_reasons') and level < DETAIL_MINIMAL:
+        out.write(f"**Risk score {summary['risk_score']}:**\n")
+        for reason in summary['risk_reasons'][:MAX_RISK_REASONS]:
+            out.write(f"- {reason['reason']}: {reason['address']} (+{reason['points']:g})\n")
+        out.write("\n")
     
-    return f'{emoji_map[risk_level]} **{risk_level}**'
+    # Add a clean plan summary before the details, one per workspace for grouped sections
+    for plan_summary in summary.get('plan_summaries', [summary['plan_summary']]):
+        out.write(f"**{plan_summary}**\n\n")
+    
+    if level == DETAIL_FULL:
+        content = summary['content']
+        if max_content is not None and len(content) > max_content:
+            omitted = len(content) - max_content
+            content = content[:max_content] + f"\n... truncated, {omitted} more characters in the build logs"
+        out.write("<details>\n")
+        out.write("<summary>Click to expand filtered plan details</summary>\n\n")
+        # Simply use code block for clean output (ANSI codes were stripped above)
+        out.write("```\n" + content + "\n```\n")
+        out.write("</details>\n")
+    elif level == DETAIL_CHANGES:
+        out.write("_Plan details collapsed to fit the comment size limit, see the build logs._\n")
+    else:
+        out.write("_Change list omitted to fit the comment size limit, see the build logs._\n")
+    return out.getvalue()
 
-def generate_content(uri):
-    """Generate PR comment content with enhanced formatting"""
+def pack_sections(sections, first_capacity, capacity):
+    """Split rendered sections, in order, into comments of at most the given sizes.
+
+    The primary comment may be left with just the summary table: a section
+    that doesn't fit what is left of it starts the first continuation comment.
+    Returns the comments and whether any section overflowed a comment on its own.
+    """
+    comments = [[]]
+    remaining = first_capacity
+    overflow = False
+    for section in sections:
+        if len(section) > remaining and (comments[-1] or len(comments) == 1):
+            comments.append([])
+            remaining = capacity
+        comments[-1].append(section)
+        remaining -= len(section)
+        overflow = overflow or remaining < 0
+    return comments, overflow
+
+def budget_sections(file_summaries, first_capacity, capacity, max_comments):
+    """Choose a detail level per file so everything fits in max_comments comments.
+
+    Sections are collapsed one step at a time starting from the lowest risk
+    file, so the riskiest plans keep their full details longest. A single
+    plan larger than a whole comment has its plan text truncated to fit the
+    continuation comment it goes into (the primary one when it is the only one).
+    """
+    levels = [DETAIL_FULL] * len(file_summaries)
+    sizes = [len(render_section(summary, DETAIL_FULL)) for summary in file_summaries]
+    # Lowest risk first, and the biggest sections first within the same risk
+    order = sorted(range(len(file_summaries)), key=lambda i: (file_summaries[i]['risk_value'], -sizes[i]))
+    
+    largest = capacity if max_comments > 1 else first_capacity
+    
+    def render(i):
+        summary = file_summaries[i]
+        section = render_section(summary, levels[i])
+        if len(section) > largest and levels[i] == DETAIL_FULL:
+            # Leave room for the truncation note
+            section = render_section(summary, DETAIL_FULL, max(0, len(summary['content']) - (len(section) - largest) - 100))
+        return section
+    
+    rendered = [render(i) for i in range(len(file_summaries))]
+    total = sum(len(section) for section in rendered)
+    budget = first_capacity + capacity * (max_comments - 1)
+    while True:
+        # Cheap running-total check first, the exact packing only once it could fit
+        if total <= budget:
+            comments, overflow = pack_sections(rendered, first_capacity, capacity)
+            if len(comments) <= max_comments and not overflow:
+                return comments
+        candidates = [i for i in order if levels[i] < DETAIL_MINIMAL]
+        if not candidates:
+            return pack_sections(rendered, first_capacity, capacity)[0]
+        i = candidates[0]
+        levels[i] += 1
+        total -= len(rendered[i])
+        rendered[i] = render(i)
+        total += len(rendered[i])
+
+def read_file_summary(item, directory='.'):
+    """Read one *_clean.txt file of directory (and its summary) into the data its comment section is rendered from"""
+    with open(os.path.join(directory, item), 'r') as file:
+        file_content = file.read()
+        
+    # Extract base file name (remove _clean.txt suffix)
+    base_name = item.replace('_clean.txt', '')
+    
+    # Extract only the relevant parts of the plan (remove ignored changes section)
+    plan_start = file_content.find('\nPlan:')
+    clean_content = file_content[plan_start + 1:] if plan_start != -1 else ""
+    
+    # Clean up ANSI color codes
+    file_content = strip_ansi_codes(clean_content.strip())
+    
+    # Use the structured summary written by tfplan.py, or parse the text for older artifacts
+    summary = load_plan_summary(os.path.join(directory, base_name))
+    fingerprints = None
+    risk = None
+    if summary is not None:
+        changes = [(change['action'], change['address']) for change in summary['changes']]
+        fingerprints = [change.get('fingerprint') for change in summary['changes']]
+        counts = summary['counts']
+        add_count, change_count = counts['add'], counts['change']
+        destroy_count, replace_count = counts['delete'], counts['replace']
+        risk = summary.get('risk')
+    else:
+        changes = parse_changes_from_text(file_content)
+        add_count = sum(1 for action, _ in changes if action == 'create')
+        change_count = sum(1 for action, _ in changes if action == 'update')
+        destroy_count = sum(1 for action, _ in changes if action == 'delete')
+        replace_count = sum(1 for action, _ in changes if action == 'replace')
+    
+    # Use the weighted risk score from tfplan.py, or the change counts for older summaries
+    if risk is not None:
+        risk_level = risk['level']
+    else:
+        risk_level = risk_scorer.count_level(
+            {'create': add_count, 'update': change_count, 'delete': destroy_count, 'replace': replace_count})
+    risk_emoji, risk_value = RISK_LEVELS[risk_level]
+    
+    # Create resource summary string
+    resource_parts = []
+    if add_count > 0:
+        resource_parts.append(f"{add_count} add")
+    if change_count > 0:
+        resource_parts.append(f"{change_count} change")
+    if destroy_count > 0:
+        resource_parts.append(f"{destroy_count} destroy")
+    if replace_count > 0:
+        resource_parts.append(f"{replace_count} replace")
+        
+    if resource_parts:
+        resource_summary = ", ".join(resource_parts)
+    else:
+        resource_summary = "No changes"
+    
+    # Format the file name for display (replace __ with / and remove .tfvars)
+    file_name = base_name.replace('__', '/') + '.tfvars'
+    
+    return {
+        "file_name": file_name,
+        "risk_level": risk_level,
+        "risk_emoji": risk_emoji,
+        "risk_value": risk_value,
+        "risk_score": risk['score'] if risk else None,
+        "risk_reasons": risk['reasons'] if risk else [],
+        "resource_summary": resource_summary,
+        "item": item,
+        "content": file_content,
+        "changes": changes,
+        "fingerprints": fingerprints,
+        "plan_summary": f"Plan: {add_count} to add, {change_count} to change, {destroy_count} to destroy, {replace_count} to replace"
+    }
+
+def workspace_of(item):
+    """Split a *_clean.txt name into its directory and workspace parts"""
+    directory, _, workspace = item.replace('_clean.txt', '').rpartition('__')
+    return directory, workspace
+
+# Text prefix of each action in the filtered plan output
+ACTION_PREFIXES = {action: prefix for prefix, action in PREFIX_ACTIONS.items()}
+
+def split_change_blocks(summary):
+    """Cut a file's plan text into one block per change, using the change addresses in order, or None"""
+    content = summary['content']
+    starts = []
+    position = 0
+    for action, address in summary['changes']:
+        marker = f"\n\n{ACTION_PREFIXES[action]} {address}"
+        start = content.find(marker, position)
+        # Skip longer addresses that merely start with this one
+        while start != -1 and content[start + len(marker):start + len(marker) + 1] not in ('', '\n'):
+            start = content.find(marker, start + 1)
+        if start == -1:
+            return None
+        starts.append(start)
+        position = start + len(marker)
+    bounds = starts + [len(content)]
+    return [content[bounds[i]:bounds[i + 1]].strip('\n') for i in range(len(starts))]
+
+def merge_workspaces(directory, members, blocks):
+    """One section for all workspaces of a directory: each distinct change once, annotated with its workspaces"""
+    workspaces = [workspace_of(member['item'])[1] for member in members]
+    unique = {}
+    for member, workspace, member_blocks in zip(members, workspaces, blocks):
+        for (action, address), fingerprint, text in zip(member['changes'], member['fingerprints'], member_blocks):
+            entry = unique.setdefault(fingerprint, {"action": action, "address": address, "text": text, "workspaces": []})
+            entry["workspaces"].append(workspace)
+
+    # Changes shared by the most workspaces first, then the per-workspace deltas
+    entries = sorted(unique.values(), key=lambda entry: -len(entry["workspaces"]))
+    changes = []
+    content = []
+    applies_to = None
+    for entry in entries:
+        label = ", ".join(entry["workspaces"])
+        changes.append((entry["action"], f"{entry['address']} _(applies to: {label})_"))
+        if label != applies_to:
+            content.append(f"# applies to: {label}")
+            applies_to = label
+        content.append(entry["text"] + "\n")
+
+    riskiest = max(members, key=lambda member: (member['risk_value'], member.get('risk_score') or 0))
+    return {
+        "file_name": f"{directory.replace('__', '/')} ({', '.join(workspaces)})",
+        "risk_level": riskiest['risk_level'],
+        "risk_emoji": riskiest['risk_emoji'],
+        "risk_value": riskiest['risk_value'],
+        "risk_score": riskiest.get('risk_score'),
+        "risk_reasons": riskiest.get('risk_reasons', []),
+        "resource_summary": riskiest['resource_summary'],
+        "item": f"{directory}__workspaces",
+        "content": "\n".join(content).rstrip('\n'),
+        "changes": changes,
+        "plan_summary": riskiest['plan_summary'],
+        "plan_summaries": [f"{workspace}: {member['plan_summary']}" for workspace, member in zip(workspaces, members)],
+    }
+
+def group_workspaces(file_summaries):
+    """Merge the sections of the workspaces of each directory so shared changes are rendered once.
+
+    Returns the sections to render and, per file, the item of the section its
+    summary table row links to. Directories with a single workspace, or with
+    files written before changes had fingerprints, keep one section per file.
+    """
+    by_directory = {}
+    for summary in file_summaries:
+        by_directory.setdefault(workspace_of(summary['item'])[0], []).append(summary)
+
+    sections = []
+    anchors = {}
+    for directory, members in by_directory.items():
+        blocks = None
+        if len(members) > 1 and all(member.get('fingerprints') is not None and all(member['fingerprints'])
+                                    for member in members):
+            blocks = [split_change_blocks(member) for member in members]
+        if not blocks or None in blocks:
+            for member in members:
+                sections.append(member)
+                anchors[member['item']] = member['item']
+            continue
+        merged = merge_workspaces(directory, members, blocks)
+        sections.append(merged)
+        for member in members:
+            anchors[member['item']] = merged['item']
+    return sections, anchors
+
+def section_hash(item, directory='.'):
+    """Hash of a plan file's name, clean text and summary, to tell which sections changed since the last run"""
+    digest = hashlib.sha256(item.encode())
+    for path in (item, item.replace('_clean.txt', '_summary.json')):
+        try:
+            with open(os.path.join(directory, path), 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(block)
+        except OSError:
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+def section_hashes(directory='.'):
+    """Section hash of every *_clean.txt file in directory"""
+    return {item: section_hash(item, directory) for item in os.listdir(directory) if item.endswith('_clean.txt')}
+
+def load_sections(path):
+    """Parsed sections saved by the last run, keyed by section hash"""
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_sections(path, sections, hashes):
+    """Save the parsed sections of the current plan files, dropping those of files that changed"""
+    current = set(hashes.values())
+    with open(path, 'w') as file:
+        json.dump({digest: summary for digest, summary in sections.items() if digest in current}, file)
+
+def comment_hash(content):
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def generate_comments(uri, size_limit=DEFAULT_COMMENT_SIZE_LIMIT, max_comments=DEFAULT_MAX_COMMENTS, report=None,
+                      sections=None, directory='.'):
+    """Generate the PR summary comment plus any continuation comments needed to stay under size_limit.
+
+    Returns a list of comment bodies; the first one is the summary. Pass
+    size_limit=None to render everything into a single comment. `report` is a
+    loaded run_report.json whose slowest jobs are listed under the summary table.
+    `sections` maps section hashes to parsed files from an earlier run; files
+    whose hash is in it are not read again, and newly parsed files are added.
+    The plan files are read from `directory`.
+    """
     overall_risk_level = "NONE"
     overall_risk_emoji = "✅"
     overall_risk_value = 0
     
     # Collect all clean.txt files (filtered terraform plan outputs)
-    clean_files = [f for f in os.listdir('.') if f.endswith('_clean.txt')]
+    clean_files = [f for f in os.listdir(directory) if f.endswith('_clean.txt')]
     
     summary_table = []
-    details = []
     file_summaries = []
     
     if not clean_files:
@@ -68,59 +405,17 @@ def generate_content(uri):
             "This analysis was automatically generated to help understand the planned infrastructure changes.\n"
             f"[View full logs]({uri})\n"
         )
-        return header + "\n\n**No Terraform changes detected in this PR.**"
+        return [header + "\n\n**No Terraform changes detected in this PR.**"]
     
-    # Process each file
+    # Process each file, reusing the parsed sections of files that did not change
     for item in clean_files:
-        with open(item, 'r') as file:
-            file_content = file.read()
-            
-        # Extract base file name (remove _clean.txt suffix)
-        base_name = item.replace('_clean.txt', '')
-        
-        # Extract only the relevant parts of the plan (remove ignored changes section)
-        clean_content = ""
-        skip_ignored = True
-        for line in file_content.split('\n'):
-            if line.startswith('Plan:'):
-                skip_ignored = False
-            if not skip_ignored:
-                clean_content += line + '\n'
-        
-        # Clean up ANSI color codes
-        file_content = strip_ansi_codes(clean_content.strip())
-        
-        # Parse for actual resource changes
-        changes = []
-        
-        # Look for resources being changed in the filtered output
-        resource_pattern = r'([~\-+/]+)\s+(.+)'
-        resource_matches = re.findall(resource_pattern, file_content)
-        
-        for prefix, resource_name in resource_matches:
-            # Only count actual resources, not attributes
-            if not resource_name.strip().startswith('~') and '=' not in resource_name:
-                changes.append(f"{prefix} {resource_name}")
-        
-        # Count actual changes by type
-        add_count = sum(1 for c in changes if c.strip().startswith('+'))
-        change_count = sum(1 for c in changes if c.strip().startswith('~'))
-        destroy_count = sum(1 for c in changes if c.strip().startswith('-') and not c.strip().startswith('-/+'))
-        replace_count = sum(1 for c in changes if c.strip().startswith('-/+'))
-        
-        # Determine risk level based on resource changes and actual detected changes
-        if add_count == 0 and change_count == 0 and destroy_count == 0 and replace_count == 0:
-            risk_level, risk_emoji, risk_value = "NONE", "✅", 0
-        elif destroy_count > 5 or replace_count > 5:
-            risk_level, risk_emoji, risk_value = "HIGH", "🔴", 4
-        elif destroy_count > 0 or replace_count > 0 or change_count > 10:
-            risk_level, risk_emoji, risk_value = "MEDIUM", "🟠", 3
-        elif change_count > 0 or add_count > 10:
-            risk_level, risk_emoji, risk_value = "LOW", "🟡", 2
-        elif add_count > 0:
-            risk_level, risk_emoji, risk_value = "MINIMAL", "🟢", 1
-        else:
-            risk_level, risk_emoji, risk_value = "NONE", "✅", 0
+        digest = section_hash(item, directory) if sections is not None else None
+        summary = sections.get(digest) if digest else None
+        if summary is None:
+            summary = read_file_summary(item, directory)
+            if sections is not None:
+                sections[digest] = summary
+        risk_level, risk_emoji, risk_value = summary['risk_level'], summary['risk_emoji'], summary['risk_value']
         
         # Track highest risk
         if risk_value > overall_risk_value:
@@ -128,74 +423,8 @@ def generate_content(uri):
             overall_risk_level = risk_level
             overall_risk_emoji = risk_emoji
         
-        # Create resource summary string
-        resource_parts = []
-        if add_count > 0:
-            resource_parts.append(f"{add_count} add")
-        if change_count > 0:
-            resource_parts.append(f"{change_count} change")
-        if destroy_count > 0:
-            resource_parts.append(f"{destroy_count} destroy")
-        if replace_count > 0:
-            resource_parts.append(f"{replace_count} replace")
-            
-        if resource_parts:
-            resource_summary = ", ".join(resource_parts)
-        else:
-            resource_summary = "No changes"
-        
-        # Format the file name for display (replace __ with / and remove .tfvars)
-        file_name = base_name.replace('__', '/') + '.tfvars'
+        file_summaries.append(summary)
         
-        # Add to file summaries for summary table
-        file_summaries.append({
-            "file_name": file_name,
-            "risk_level": risk_level,
-            "risk_emoji": risk_emoji,
-            "resource_summary": resource_summary,
-            "item": item,
-            "content": file_content,
-            "changes": changes
-        })
-        
-        # Add detailed section
-        details.append(f"\n<a id='file-{item.replace('.', '').lower()}'></a>\n")
-        details.append(f"## {risk_emoji} {file_name}")
-        
-        # Show the list of changes if there are any
-        if changes:
-            details.append("\n**Changes:**")
-            for change in changes:
-                # Clean up ANSI codes and simplify the formatting
-                clean_change = strip_ansi_codes(change).strip()
-                
-                # Format with appropriate emoji based on the change type
-                if clean_change.startswith('+'):
-                    details.append(f"- ➕ {clean_change[1:].strip()}")
-                elif clean_change.startswith('~'):
-                    details.append(f"- 🔄 {clean_change[1:].strip()}")
-                elif clean_change.startswith('-/+'):
-                    details.append(f"- ♻️ {clean_change[3:].strip()}")
-                elif clean_change.startswith('-'):
-                    details.append(f"- ❌ {clean_change[1:].strip()}")
-                else:
-                    details.append(f"- {clean_change}")
-            details.append("")
-            
-        # Add a clean plan summary before the details
-        plan_summary = f"Plan: {add_count} to add, {change_count} to change, {destroy_count} to destroy, {replace_count} to replace"
-        details.append(f"**{plan_summary}**\n")
-            
-        details.append("<details>")
-        details.append("<summary>Click to expand filtered plan details</summary>\n")
-        
-        # Create a cleaner version of the file content with no ANSI codes
-        clean_file_content = strip_ansi_codes(file_content)
-        
-        # Simply use code block for clean output
-        details.append("```\n" + clean_file_content + "\n```")
-        details.append("</details>\n")
-    
     # Create header with overall risk level
     header = (
         f"# 🔍 Terraform Plan Summary — {overall_risk_emoji} {overall_risk_level} RISK\n"
@@ -209,49 +438,148 @@ def generate_content(uri):
     summary_table.append("| File | Risk | Changes | Details |")
     summary_table.append("|------|------|---------|---------|")
     
+    # Workspaces of the same directory share one details section
+    plan_sections, anchors = group_workspaces(file_summaries)
+    
     # Add rows to summary table
     for summary in file_summaries:
         summary_table.append(
             f"| {summary['file_name']} | "
             f"{summary['risk_emoji']} {summary['risk_level']} | "
             f"{summary['resource_summary']} | "
-            f"[View Details](#file-{summary['item'].replace('.', '').lower()}) |"
+            f"[View Details](#file-{anchors[summary['item']].replace('.', '').lower()}) |"
         )
     
     # Combine all parts
-    content = header + "\n" + "\n".join(summary_table) + "\n\n" + "\n".join(details) + "\n\n---\n"
-    content += "*ℹ️ Resolve this comment before merging if changes require review*"
+    primary_head = header + "\n" + "\n".join(summary_table) + "\n\n"
+    timings = timing_table(report) if report else ""
+    if timings:
+        primary_head += "<details>\n<summary>⏱️ Slowest plans</summary>\n\n" + timings + "\n</details>\n\n"
+    footer = "\n\n---\n*ℹ️ Resolve this comment before merging if changes require review*"
     
-    return content
-
-def get_thread_id(organization_uri, project, token, repository_id, pr_id):
-    url = f"{organization_uri}{project}/_apis/git/repositories/{repository_id}/pullRequests/{pr_id}/threads?api-version=7.1-preview.1"
-    response = requests.get(url, headers=generate_auth_header(token))
-    response.raise_for_status()
-    return next((thread['id'] for thread in response.json()['value']
-                 if thread['comments'][0]['content'].startswith("# 🔍 Terraform Plan Summary") or
-                    thread['comments'][0]['content'].startswith("# RESOLVE BEFORE MERGE")), None)
-
-def post_comment(url, headers, content):
-    response = requests.post(url, headers=headers, data=json.dumps({
-        "comments": [{"parentCommentId": 0, "content": content, "commentType": "text"}],
-        "status": "active"
-    }))
-    response.raise_for_status()
-    return response.json()
-
-def add_or_update_pr_comment(organization_uri, project, token, repository_id, pr_id, build_id):
-    headers = generate_auth_header(token)
+    if size_limit is None:
+        groups = [[render_section(summary, DETAIL_FULL) for summary in plan_sections]]
+    else:
+        continuation_overhead = len(continuation_heading(max_comments, max_comments))
+        groups = budget_sections(
+            plan_sections,
+            size_limit - len(primary_head) - len(continued_note(max_comments)) - len(footer),
+            size_limit - continuation_overhead,
+            max_comments
+        )
+    
+    note = continued_note(len(groups)) if len(groups) > 1 else ""
+    comments = [primary_head + "".join(groups[0]) + note + footer]
+    for index, group in enumerate(groups[1:], start=2):
+        comments.append(continuation_heading(index, len(groups)) + "".join(group))
+    return comments
+
+def generate_content(uri):
+    """Generate PR comment content with enhanced formatting"""
+    return generate_comments(uri, size_limit=None)[0]
+
+def thread_content(thread):
+    comments = thread.get('comments') or [{}]
+    return comments[0].get('content') or ''
+
+def is_plan_summary_thread(thread):
+    """True for the thread holding the Terraform plan summary comment"""
+    content = thread_content(thread)
+    return content.startswith("# 🔍 Terraform Plan Summary") or content.startswith("# RESOLVE BEFORE MERGE")
+
+def find_comment_threads(client, repository_id, pr_id):
+    """List the PR threads once and return the summary thread id and the continuation thread ids in part order"""
+    summary_id = None
+    parts = {}
+    spare = []
+    for thread in client.iter_threads(repository_id, pr_id):
+        content = thread_content(thread)
+        if summary_id is None and is_plan_summary_thread(thread):
+            summary_id = thread['id']
+        elif content.startswith(CONTINUATION_HEADING):
+            match = re.match(r'.*\(part (\d+)/\d+\)', content.split('\n', 1)[0])
+            if match:
+                parts[int(match.group(1))] = thread['id']
+            else:
+                # Blanked by an earlier run, can be reused
+                spare.append(thread['id'])
+    return summary_id, [parts[part] for part in sorted(parts)] + spare
+
+def upsert_thread(client, repository_id, pr_id, thread_id, content):
+    """Update the first comment of a thread, or start a new thread if it is unknown or was deleted"""
+    import requests
+    if thread_id:
+        try:
+            client.update_comment(repository_id, pr_id, thread_id, content)
+            return thread_id
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            print(f"Thread {thread_id} no longer exists")
+    return client.create_thread(repository_id, pr_id, content)['id']
+
+def add_or_update_pr_comment(organization_uri, project, token, repository_id, pr_id, build_id, state_dir='.',
+                             size_limit=DEFAULT_COMMENT_SIZE_LIMIT, max_comments=DEFAULT_MAX_COMMENTS):
+    # The state is saved after posting, so a missing folder must not fail the run then
+    os.makedirs(state_dir, exist_ok=True)
+    state = ThreadStateStore(os.path.join(state_dir, 'pr_comment_state.json'))
+    sections_path = os.path.join(state_dir, 'pr_comment_sections.json')
+    saved = state.get(repository_id, pr_id)
+    thread_id = saved.get('thread_id')
+    continuation_ids = saved.get('continuation_thread_ids', [])
+
+    # Nothing to do when no plan changed since the comment was last written
+    hashes = section_hashes()
+    settings = [size_limit, max_comments]
+    if thread_id and saved.get('section_hashes') == hashes and saved.get('comment_settings') == settings:
+        print("No plan changed since the last run, leaving the PR comment as it is")
+        return
+
+    # Only import requests and open a session once there is something to post
+    import requests
+    client = AzureDevOpsClient(organization_uri, project, token)
     build_uri = f"{organization_uri}/{project}/_build/results?buildId={build_id}&view=logs"
-    content = generate_content(build_uri)
+    report = load_report(os.path.join(state_dir, 'run_report.json'))
+    sections = load_sections(sections_path)
+    comments = generate_comments(build_uri, size_limit, max_comments, report, sections)
 
-    thread_id = get_thread_id(organization_uri, project, token, repository_id, pr_id)
+    # Reuse the threads found by an earlier run, and only list threads when they are unknown or gone
     if thread_id:
-        url = f"{organization_uri}{project}/_apis/git/repositories/{repository_id}/pullRequests/{pr_id}/threads/{thread_id}/comments/1?api-version=7.1-preview.1"
-        requests.patch(url, headers=headers, data=json.dumps({"content": content, "commentType": "text"})).raise_for_status()
-    else:
-        url = f"{organization_uri}{project}/_apis/git/repositories/{repository_id}/pullRequests/{pr_id}/threads?api-version=7.1-preview.1"
-        post_comment(url, headers, content)
+        try:
+            client.update_comment(repository_id, pr_id, thread_id, comments[0])
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            print(f"Saved thread {thread_id} no longer exists, looking it up again")
+            thread_id = None
+    if not thread_id:
+        thread_id, continuation_ids = find_comment_threads(client, repository_id, pr_id)
+        thread_id = upsert_thread(client, repository_id, pr_id, thread_id, comments[0])
+        saved = {}
+
+    # Continuation comments are updated in place, in part order, skipping parts whose text is unchanged
+    previous_hashes = saved.get('comment_hashes', [])
+    comment_hashes = [comment_hash(content) for content in comments]
+    used_ids = []
+    for index, content in enumerate(comments[1:]):
+        existing = continuation_ids[index] if index < len(continuation_ids) else None
+        if existing and index + 1 < len(previous_hashes) and previous_hashes[index + 1] == comment_hashes[index + 1]:
+            used_ids.append(existing)
+            continue
+        used_ids.append(upsert_thread(client, repository_id, pr_id, existing, content))
+
+    # Parts left over from a bigger earlier run are blanked but kept for reuse
+    spare_ids = continuation_ids[len(used_ids):]
+    live_parts = len(previous_hashes) - 1 if previous_hashes else len(continuation_ids)
+    for spare_id in continuation_ids[len(used_ids):live_parts]:
+        try:
+            client.update_comment(repository_id, pr_id, spare_id,
+                                  f"{CONTINUATION_HEADING}\n_No longer needed, all details fit in the comments above._")
+        except requests.HTTPError as e:
+            print(f"Could not clear continuation thread {spare_id}: {e}")
+    save_sections(sections_path, sections, hashes)
+    state.set(repository_id, pr_id, thread_id=thread_id, continuation_thread_ids=used_ids + spare_ids,
+              section_hashes=hashes, comment_settings=settings, comment_hashes=comment_hashes)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Add or update a PR comment in Azure DevOps.')
@@ -261,9 +589,17 @@ if __name__ == "__main__":
     parser.add_argument('--repository_id', required=True)
     parser.add_argument('--pull_request_id', required=True)
     parser.add_argument('--build_id', required=True)
+    parser.add_argument('--state_dir', default=os.getenv('ARTIFACT_FOLDER', '.'),
+                        help='Folder for the saved comment state and parsed plan sections (default: ARTIFACT_FOLDER or .)')
+    parser.add_argument('--comment_size_limit', type=int,
+                        default=int(os.getenv('COMMENT_SIZE_LIMIT', DEFAULT_COMMENT_SIZE_LIMIT)),
+                        help='Maximum characters per PR comment (default: COMMENT_SIZE_LIMIT or 150000)')
+    parser.add_argument('--max_comments', type=int, default=DEFAULT_MAX_COMMENTS,
+                        help='Maximum number of comments, summary included, before details are collapsed')
 
     args = parser.parse_args()
     add_or_update_pr_comment(
         args.organization_uri, args.project, args.person_access_token,
-        args.repository_id, args.pull_request_id, args.build_id
+        args.repository_id, args.pull_request_id, args.build_id, args.state_dir,
+        args.comment_size_limit, args.max_comments
     )
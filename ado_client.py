@@ -0,0 +1,135 @@
+import base64
+import json
+import os
+import time
+from email.utils import parsedate_to_datetime
+
+API_VERSION = "7.1-preview.1"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Retried only when the server can't have acted on them, or a second thread would be posted
+NON_IDEMPOTENT_METHODS = {'POST'}
+
+def generate_auth_header(token):
+    return {
+        'Authorization': f'Basic {base64.b64encode(token.encode()).decode()}',
+        'Content-Type': 'application/json'
+    }
+
+def _retry_after(response, default):
+    """Seconds to wait according to a Retry-After header (delta-seconds or HTTP date)"""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+def _not_sent(error):
+    """Whether a connection error happened before the request reached the server"""
+    import requests
+    from urllib3.exceptions import NewConnectionError
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+class AzureDevOpsClient:
+    """Pull request threads API over one pooled session, with retries.
+
+    429 and 5xx responses and connection errors are retried with exponential
+    backoff, waiting for Retry-After when the server sends it. POST requests
+    are only retried on 429 and when the connection failed before sending,
+    since the server may have created the thread behind a timeout or 5xx.
+    """
+
+    def __init__(self, organization_uri, project, token, retries=5, backoff=1.0, timeout=30, pool_size=10):
+        # requests takes longer to import than rendering a comment, so only load it to talk to the API
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.base_uri = f"{organization_uri}{project}/_apis/git/repositories"
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(generate_auth_header(token))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        import requests
+        kwargs.setdefault('timeout', self.timeout)
+        params = dict(kwargs.pop('params', None) or {}, **{'api-version': API_VERSION})
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                response = self.session.request(method, url, params=params, **kwargs)
+                retry = response.status_code in RETRY_STATUSES
+                if method in NON_IDEMPOTENT_METHODS:
+                    retry = response.status_code == 429
+                if not retry:
+                    response.raise_for_status()
+                    return response
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries or (method in NON_IDEMPOTENT_METHODS and not _not_sent(e)):
+                    raise
+            if attempt == self.retries:
+                response.raise_for_status()
+            delay = _retry_after(response, self.backoff * (2 ** attempt))
+            print(f"{method} {url} failed ({response.status_code if response is not None else 'connection error'}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def _threads_url(self, repository_id, pr_id):
+        return f"{self.base_uri}/{repository_id}/pullRequests/{pr_id}/threads"
+
+    def iter_threads(self, repository_id, pr_id):
+        """Yield PR threads page by page, following x-ms-continuationtoken"""
+        params = {}
+        while True:
+            response = self.request('GET', self._threads_url(repository_id, pr_id), params=params)
+            yield from response.json().get('value', [])
+            token = response.headers.get('x-ms-continuationtoken')
+            if not token:
+                return
+            params = {'continuationToken': token}
+
+    def create_thread(self, repository_id, pr_id, content):
+        response = self.request('POST', self._threads_url(repository_id, pr_id), data=json.dumps({
+            "comments": [{"parentCommentId": 0, "content": content, "commentType": "text"}],
+            "status": "active"
+        }))
+        return response.json()
+
+    def update_comment(self, repository_id, pr_id, thread_id, content, comment_id=1):
+        url = f"{self._threads_url(repository_id, pr_id)}/{thread_id}/comments/{comment_id}"
+        response = self.request('PATCH', url, data=json.dumps({"content": content, "commentType": "text"}))
+        return response.json()
+
+class ThreadStateStore:
+    """Remembers the comment threads and section hashes per PR so reruns can PATCH without listing threads"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, repository_id, pr_id):
+        """Return the saved state of a PR, e.g. {"thread_id": 42}, or an empty dict"""
+        return self._load().get(f"{repository_id}/{pr_id}", {})
+
+    def set(self, repository_id, pr_id, **values):
+        state = self._load()
+        state.setdefault(f"{repository_id}/{pr_id}", {}).update(values)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(state, f)
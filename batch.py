@@ -0,0 +1,150 @@
+"""Process plan jobs in one long-running process, so pipelines that process many plans pay startup once.
+
+    python batch.py < jobs.ndjson                                # jobs on stdin, results on stdout
+    python batch.py --socket /tmp/tfplan.sock &                  # serve jobs on a unix socket
+    python batch.py --socket /tmp/tfplan.sock --send < jobs.ndjson
+
+Every job is one JSON object per line and gets one JSON result line back,
+with the job's `id` when it has one:
+
+    {"op": "process", "plan": "plans/apps__app1__prod.json", "output": "out"}
+    {"op": "comment", "output": "out", "logs_uri": "https://...", "size_limit": 150000}
+    {"op": "ping"}
+    {"op": "shutdown"}
+
+`process` filters and renders one plan JSON or .tfplan file like reprocess.py,
+`comment` renders the PR comment for an output folder. The processing modules
+(and the noise rules, risk weights and resource type map they load) are only
+imported by the first job that needs them, so `ping` and `--send` start
+without them.
+"""
+import os
+import sys
+import json
+import shutil
+import socket
+import argparse
+import threading
+import socketserver
+from contextlib import redirect_stdout
+
+def process_job(job):
+    import reprocess
+    import tfplan
+    plan = job["plan"]
+    output_dir = os.path.abspath(job.get("output", "reprocessed"))
+    os.makedirs(output_dir, exist_ok=True)
+    j2md = job.get("j2md", tfplan.TERRAFORM_J2MD)
+    _, ok, lines = reprocess.reprocess_plan(os.path.abspath(plan), output_dir, j2md and shutil.which(j2md))
+    file_name = os.path.join(output_dir, reprocess.output_name(plan))
+    candidates = [f"{file_name}.json", f"{file_name}.md", f"{file_name}_clean.txt", f"{file_name}_summary.json",
+                  tfplan.clean_json_file(file_name)]
+    return {"ok": ok, "outputs": [path for path in candidates if os.path.exists(path)], "log": lines}
+
+def comment_job(job):
+    import reprocess
+    paths = reprocess.write_comments(job.get("output", "reprocessed"), job.get("logs_uri", "#"), job.get("size_limit"))
+    return {"ok": True, "outputs": paths}
+
+JOBS = {
+    "process": process_job,
+    "comment": comment_job,
+    "ping": lambda job: {"ok": True},
+}
+
+def handle(line):
+    """Run one job line and return its result as a dict"""
+    job = {}
+    try:
+        job = json.loads(line)
+        op = job.get("op", "process")
+        if op not in JOBS:
+            raise ValueError(f"unknown op {op!r}")
+        result = JOBS[op](job)
+    except Exception as e:
+        result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    if isinstance(job, dict) and "id" in job:
+        result["id"] = job["id"]
+    return result
+
+def is_shutdown(line):
+    try:
+        return json.loads(line).get("op") == "shutdown"
+    except (ValueError, AttributeError):
+        return False
+
+def serve_stream(lines, write):
+    """Handle jobs from an iterable of lines until it ends or a shutdown job arrives; returns False on shutdown"""
+    for line in lines:
+        if not line.strip():
+            continue
+        if is_shutdown(line):
+            write(json.dumps({"ok": True}) + "\n")
+            return False
+        write(json.dumps(handle(line)) + "\n")
+    return True
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """One connection: job lines in, result lines out, handled on the connection's own thread"""
+
+    def handle(self):
+        lines = (line.decode() for line in self.rfile)
+        def write(text):
+            self.wfile.write(text.encode())
+            self.wfile.flush()
+        if not serve_stream(lines, write):
+            # shutdown() waits for serve_forever, which runs on the main thread
+            threading.Thread(target=self.server.shutdown).start()
+
+class JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve_socket(path):
+    if os.path.exists(path):
+        os.remove(path)
+    with JobServer(path, JobHandler) as server:
+        print(f"Serving plan jobs on {path}", flush=True)
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(path)
+
+def send(path, lines):
+    """Send job lines to a running server and print the results; returns True when every job succeeded"""
+    ok = True
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        with connection.makefile('rw') as stream:
+            for line in lines:
+                if not line.strip():
+                    continue
+                stream.write(line.rstrip("\n") + "\n")
+                stream.flush()
+                result = stream.readline()
+                print(result, end="", flush=True)
+                ok = ok and json.loads(result).get("ok", False)
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description='Process plan jobs from stdin or a unix socket in one long-running process.')
+    parser.add_argument('--socket', help='Serve jobs on this unix socket instead of stdin')
+    parser.add_argument('--send', action='store_true', help='Send the jobs on stdin to the server on --socket')
+    args = parser.parse_args()
+
+    if args.send:
+        if not args.socket:
+            parser.error("--send needs --socket")
+        sys.exit(0 if send(args.socket, sys.stdin) else 1)
+    if args.socket:
+        serve_socket(args.socket)
+    else:
+        results = sys.stdout
+        def write(text):
+            results.write(text)
+            results.flush()
+        # stdout carries the results, so anything the jobs print goes to stderr
+        with redirect_stdout(sys.stderr):
+            serve_stream(sys.stdin, write)
+
+if __name__ == "__main__":
+    main()
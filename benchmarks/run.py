@@ -0,0 +1,176 @@
+"""Offline benchmarks for the plan post-processing stages.
+
+Generates synthetic plans, times filter_plan_json, process_file and
+generate_content on them (best of --repeat runs), measures each stage's
+Python heap peak in a separate tracemalloc run, and compares the results to a
+stored baseline. Exits 1 when a stage got slower or bigger than the baseline
+by more than --threshold, or, with --require-baseline, when a scenario has no
+baseline to compare to. No terraform binary or network access is needed.
+
+    python -m benchmarks.run --scenario small --scenario medium --require-baseline
+    python -m benchmarks.run --resources 50000 --save-baseline
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tfplan
+from add_pr_comment import generate_content
+from benchmarks.synthetic_plan import PlanShape, write_markdown, write_plan
+
+SCENARIOS = {
+    "small": dict(resources=1000),
+    "medium": dict(resources=10000),
+    "large": dict(resources=100000, depth=2, app_settings=10),
+    "deep": dict(resources=5000, depth=6),
+    "churn": dict(resources=10000, tag_churn=0.9, alerts=0.4),
+}
+DEFAULT_SCENARIOS = ["small", "medium"]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_THRESHOLD = 0.25
+# Timings below this many seconds are dominated by noise and never count as regressions
+MIN_SECONDS = 0.05
+
+def _stages(workdir, shape):
+    """(name, setup, run) for each benchmarked stage; setup runs outside the measurement"""
+    file_name = os.path.join(workdir, "app__prod")
+    markdown = f"{file_name}.md"
+
+    def filter_plan():
+        if tfplan.filter_plan_json(file_name) is None:
+            raise RuntimeError("filter_plan_json failed")
+
+    return [
+        ("filter_plan_json", lambda: None, filter_plan),
+        ("process_file", lambda: write_markdown(markdown, shape), lambda: tfplan.process_file(markdown)),
+        ("generate_content", lambda: None, lambda: generate_content("https://example.invalid/build")),
+    ]
+
+def _measure(setup, run, repeat):
+    """Best wall time of `repeat` runs, then the Python heap peak of one more run"""
+    best = None
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    setup()
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": round(best, 4), "peak_bytes": peak}
+
+def run_scenario(name, shape, repeat, keep=False):
+    workdir = tempfile.mkdtemp(prefix=f"tfplan-bench-{name}-")
+    cwd = os.getcwd()
+    try:
+        plan_path = os.path.join(workdir, "app__prod.json")
+        write_plan(plan_path, shape)
+        results = {"plan_bytes": os.path.getsize(plan_path), "resources": shape.resources}
+        # generate_content reads the *_clean.txt files of the current directory
+        os.chdir(workdir)
+        for stage, setup, run in _stages(workdir, shape):
+            results[stage] = _measure(setup, run, repeat)
+        return results
+    finally:
+        os.chdir(cwd)
+        if keep:
+            print(f"Kept {name} artifacts in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def compare(results, baseline, threshold):
+    """Return a list of regression messages against the baseline results"""
+    regressions = []
+    for scenario, stages in results.items():
+        expected = baseline.get(scenario)
+        if not expected:
+            continue
+        if expected.get("resources") != stages.get("resources"):
+            print(f"{scenario}: baseline was recorded at a different scale, skipping comparison")
+            continue
+        for stage, measured in stages.items():
+            if not isinstance(measured, dict) or stage not in expected:
+                continue
+            before = expected[stage]
+            if measured["seconds"] > max(before["seconds"] * (1 + threshold), MIN_SECONDS):
+                regressions.append(f"{scenario}/{stage}: {before['seconds']:.3f}s -> {measured['seconds']:.3f}s")
+            if measured["peak_bytes"] > before["peak_bytes"] * (1 + threshold):
+                regressions.append(f"{scenario}/{stage}: peak {before['peak_bytes'] / 1048576:.1f} MB -> "
+                                   f"{measured['peak_bytes'] / 1048576:.1f} MB")
+    return regressions
+
+def print_results(results):
+    print(f"{'Scenario':<10} {'Stage':<18} {'Seconds':>9} {'Peak MB':>9}")
+    for scenario, stages in results.items():
+        for stage, measured in stages.items():
+            if isinstance(measured, dict):
+                print(f"{scenario:<10} {stage:<18} {measured['seconds']:>9.3f} {measured['peak_bytes'] / 1048576:>9.1f}")
+        print(f"{scenario:<10} {'plan size':<18} {stages['plan_bytes'] / 1048576:>9.1f} MB, {stages['resources']} resource changes")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark plan post-processing on synthetic plans")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help=f"Scenario to run, may be repeated (default: {', '.join(DEFAULT_SCENARIOS)})")
+    parser.add_argument("--resources", type=int, help="Run a custom scenario with this many resource changes")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage; the best one is kept")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline results file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed relative slowdown or memory growth before failing")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated plans and outputs")
+    parser.add_argument("--require-baseline", action="store_true",
+                        help="Fail when a scenario has no baseline, so CI never passes without comparing")
+    args = parser.parse_args()
+
+    scenarios = {name: PlanShape(**SCENARIOS[name]) for name in args.scenario or []}
+    if args.resources:
+        scenarios["custom"] = PlanShape(resources=args.resources)
+    if not scenarios:
+        scenarios = {name: PlanShape(**SCENARIOS[name]) for name in DEFAULT_SCENARIOS}
+
+    results = {name: run_scenario(name, shape, args.repeat, args.keep) for name, shape in scenarios.items()}
+    print_results(results)
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        baseline = {}
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    missing = [name for name in results if name not in baseline]
+    if missing and args.require_baseline:
+        print(f"No baseline for {', '.join(missing)} in {args.baseline}; run with --save-baseline to record one")
+        sys.exit(1)
+    if not baseline:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one")
+        return
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"Regressions beyond {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("No regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Synthetic `terraform show -json` documents for benchmarking the processing stages."""
+import json
+import random
+
+RESOURCE_TYPES = [
+    "azurerm_linux_web_app",
+    "azurerm_linux_web_app_slot",
+    "azurerm_storage_account",
+    "azurerm_storage_container",
+    "azurerm_servicebus_queue",
+    "azurerm_redis_cache",
+    "azurerm_private_endpoint",
+]
+
+ACTIONS = [["create"], ["update"], ["delete"], ["delete", "create"], ["no-op"]]
+
+class PlanShape:
+    """Knobs for a synthetic plan; ratios are fractions of all resource changes"""
+
+    def __init__(self, resources=1000, depth=3, app_settings=50, tag_churn=0.3, alerts=0.1, sensitive=0.05,
+                 state_weight=1.0, seed=42):
+        self.resources = resources
+        self.depth = depth                  # nesting depth of site_config-style blocks
+        self.app_settings = app_settings    # settings per app_settings map
+        self.tag_churn = tag_churn          # updates that only change tags
+        self.alerts = alerts                # coralogix_alert resources
+        self.sensitive = sensitive          # updates with sensitive values
+        self.state_weight = state_weight    # prior_state size relative to resource_changes
+        self.seed = seed
+
+def _nested_block(rng, depth, app_settings):
+    block = {
+        "always_on": True,
+        "ftps_state": "Disabled",
+        "app_settings": {f"SETTING_{i}": f"value-{rng.randint(0, 9)}" for i in range(app_settings)},
+        "ip_restriction": [{"name": f"rule-{i}", "ip_address": f"10.0.{i}.0/24", "priority": 100 + i} for i in range(3)],
+    }
+    if depth > 1:
+        block["application_stack"] = [_nested_block(rng, depth - 1, max(1, app_settings // 4))]
+    return block
+
+def _mutate(rng, value):
+    """Change one leaf somewhere inside a nested block"""
+    value = json.loads(json.dumps(value))
+    node = value
+    while True:
+        if "application_stack" in node and rng.random() < 0.5:
+            node = node["application_stack"][0]
+            continue
+        key = rng.choice(list(node["app_settings"]))
+        node["app_settings"][key] = "changed"
+        return value
+
+def _resource_change(rng, shape, index):
+    if rng.random() < shape.alerts:
+        return {
+            "address": f"module.alerts.coralogix_alert.alert_{index % 500}[{index}]",
+            "type": "coralogix_alert",
+            "change": {"actions": ["update"], "before": {"name": "a"}, "after": {"name": "b"}},
+        }
+
+    resource_type = rng.choice(RESOURCE_TYPES)
+    address = f"module.app_{index % 40}.{resource_type}.res_{index}"
+    before = {
+        "name": f"res-{index}",
+        "location": "westeurope",
+        "sku_name": "P1v2",
+        "tags": {"env": "prod", "owner": "team", "build": "1"},
+        "site_config": [_nested_block(rng, shape.depth, shape.app_settings)],
+    }
+    actions = rng.choice(ACTIONS)
+    after = json.loads(json.dumps(before))
+    before_sensitive = after_sensitive = {}
+
+    if actions == ["update"]:
+        if rng.random() < shape.tag_churn:
+            after["tags"]["build"] = "2"
+        else:
+            after["site_config"] = [_mutate(rng, before["site_config"][0])]
+            if rng.random() < 0.3:
+                after["sku_name"] = "P2v2"
+            if rng.random() < shape.sensitive:
+                before_sensitive = {"site_config": [{"app_settings": True}]}
+                after_sensitive = {"site_config": [{"app_settings": True}], "name": True}
+    elif actions == ["create"]:
+        before = None
+    elif actions == ["delete"]:
+        after = None
+
+    return {
+        "address": address,
+        "module_address": f"module.app_{index % 40}",
+        "mode": "managed",
+        "type": resource_type,
+        "name": f"res_{index}",
+        "provider_name": "registry.terraform.io/hashicorp/azurerm",
+        "change": {
+            "actions": actions,
+            "before": before,
+            "after": after,
+            "after_unknown": {},
+            "before_sensitive": before_sensitive,
+            "after_sensitive": after_sensitive,
+        },
+    }
+
+def write_plan(path, shape):
+    """Write a synthetic plan JSON to path, one resource change at a time"""
+    rng = random.Random(shape.seed)
+    with open(path, 'w') as f:
+        f.write('{"format_version":"1.2","terraform_version":"1.5.7","planned_values":{"root_module":{}},')
+        f.write('"resource_changes":[')
+        for index in range(shape.resources):
+            if index:
+                f.write(',')
+            f.write(json.dumps(_resource_change(rng, shape, index), separators=(',', ':')))
+        f.write('],"prior_state":{"values":{"root_module":{"resources":[')
+        for index in range(int(shape.resources * shape.state_weight)):
+            if index:
+                f.write(',')
+            f.write(json.dumps({
+                "address": f"module.app_{index % 40}.azurerm_linux_web_app.res_{index}",
+                "values": {"name": f"res-{index}", "site_config": [_nested_block(rng, 1, shape.app_settings)]},
+            }, separators=(',', ':')))
+        f.write(']}}},"configuration":{"root_module":{"module_calls":{')
+        f.write(','.join(f'"app_{i}":{{"source":"../../modules/app"}}' for i in range(40)))
+        f.write('}}}}')
+
+def write_markdown(path, shape):
+    """Write terraform-j2md style markdown with one heading and one list line per resource"""
+    rng = random.Random(shape.seed)
+    with open(path, 'w') as f:
+        f.write("## Terraform Plan\n\n")
+        for index in range(shape.resources):
+            resource_type = rng.choice(RESOURCE_TYPES)
+            address = f"module.app_{index % 40}.{resource_type}.res_{index}"
+            f.write(f"    - module{address[6:]}\n")
+            f.write(f"# module{address[6:]} will be updated in-place\n")
+            f.write("@@ -1,3 +1,3 @@\n")
+            f.write(f"-  sku_name = \"P1v2\"\n+  sku_name = \"P2v2\"\n\n")
@@ -0,0 +1,118 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+from scheduler import bind_log, current_log, log
+
+class CommandResult:
+    """Outcome of a command run through `run`"""
+
+    def __init__(self, args, returncode, duration, stdout_bytes, stderr_bytes, output, cpu_time=0.0, max_rss_kb=0):
+        self.args = args
+        self.returncode = returncode
+        self.duration = duration
+        self.stdout_bytes = stdout_bytes
+        self.stderr_bytes = stderr_bytes
+        self.output = output  # stdout lines, empty when stdout went to a file
+        self.cpu_time = cpu_time  # user + system CPU seconds of the child
+        self.max_rss_kb = max_rss_kb
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    def __iter__(self):
+        return iter(self.output)
+
+    def __repr__(self):
+        return (f"CommandResult(args={self.args!r}, returncode={self.returncode}, duration={self.duration:.2f}, "
+                f"stdout_bytes={self.stdout_bytes}, stderr_bytes={self.stderr_bytes})")
+
+def _pump(stream, sink, counter, log_buffer, prefix=""):
+    """Forward lines from a pipe to the log as they arrive"""
+    bind_log(log_buffer)
+    for raw in iter(stream.readline, b''):
+        counter[0] += len(raw)
+        line = raw.decode(errors='replace')
+        if sink is not None:
+            sink.append(line)
+        log(prefix + line.rstrip('\n'))
+    stream.close()
+
+def _wait(process):
+    """Wait for a child and return (returncode, cpu seconds, max RSS in KB) for that child alone"""
+    if not hasattr(os, 'wait4'):
+        return process.wait(), 0.0, 0
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+def run(args, cwd=None, env=None, stdin_path=None, stdout_path=None, append=False, echo=True):
+    """Run a command without a shell.
+
+    stdout is written straight to `stdout_path` when given (appended with
+    `append=True`), otherwise it is streamed to the log line by line and kept in
+    the result. stderr is always streamed to the log. `env` holds variables to
+    set on top of the current environment.
+    """
+    if echo:
+        log(f"Running command {' '.join(args)}. Output:")
+    full_env = dict(os.environ, **env) if env else None
+    stdin = open(stdin_path, 'rb') if stdin_path else subprocess.DEVNULL
+    stdout_file = open(stdout_path, 'ab' if append else 'wb') if stdout_path else None
+    start_size = os.fstat(stdout_file.fileno()).st_size if stdout_file else 0
+    output = []
+    stdout_count = [0]
+    stderr_count = [0]
+    start = time.monotonic()
+    try:
+        process = subprocess.Popen(args, cwd=cwd, env=full_env, stdin=stdin,
+                                   stdout=stdout_file or subprocess.PIPE, stderr=subprocess.PIPE)
+        stderr_thread = threading.Thread(target=_pump, args=(process.stderr, None, stderr_count, current_log()))
+        stderr_thread.start()
+        if stdout_file is None:
+            _pump(process.stdout, output, stdout_count, current_log())
+        returncode, cpu_time, max_rss_kb = _wait(process)
+        stderr_thread.join()
+    finally:
+        if stdin_path:
+            stdin.close()
+        if stdout_file:
+            stdout_count[0] = os.fstat(stdout_file.fileno()).st_size - start_size
+            stdout_file.close()
+    return CommandResult(args, returncode, time.monotonic() - start, stdout_count[0], stderr_count[0], output,
+                         cpu_time, max_rss_kb)
+
+def append_line(path, line):
+    """Append a line to a text file"""
+    with open(path, 'a') as f:
+        f.write(f"{line}\n")
+
+def sync_file(source, destination):
+    """Copy a file unless destination already has the same size and mtime. Returns True when it copied"""
+    stat = os.stat(source)
+    try:
+        target = os.stat(destination)
+        if target.st_size == stat.st_size and target.st_mtime_ns == stat.st_mtime_ns:
+            return False
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+    # copy2 keeps the mtime, so the next sync sees the file as unchanged
+    shutil.copy2(source, destination)
+    return True
+
+def sync_dir_contents(source, destination):
+    """Copy the non-hidden files of a directory tree that are new or changed since the last sync.
+
+    Hidden entries (.terraform, .git, ...) are skipped at every level. Returns
+    the number of files copied.
+    """
+    copied = 0
+    for current, subdirs, files in os.walk(source):
+        subdirs[:] = [name for name in subdirs if not name.startswith('.')]
+        target_dir = os.path.normpath(os.path.join(destination, os.path.relpath(current, source)))
+        for name in files:
+            if not name.startswith('.') and sync_file(os.path.join(current, name), os.path.join(target_dir, name)):
+                copied += 1
+    return copied
@@ -0,0 +1,143 @@
+import os
+import re
+import hashlib
+import threading
+from glob import glob
+from module_index import parse_module_sources
+
+STAMP_FILE = os.path.join(".terraform", "tfplan-init.sha256")
+
+# Lines of the configuration that change what `terraform init` installs:
+# module/provider sources and version constraints
+_INSTALL_LINE = re.compile(r'^\s*(source|version)\s*=.*$', re.MULTILINE)
+_BACKEND_BLOCK = re.compile(r'backend\s+"[^"]*"\s*\{')
+_REQUIRED_PROVIDERS_BLOCK = re.compile(r'required_providers\s*\{')
+
+def _blocks(pattern, text):
+    """Return the text of every block starting with pattern in a .tf file"""
+    blocks = []
+    for match in pattern.finditer(text):
+        depth = 0
+        for index in range(match.end() - 1, len(text)):
+            if text[index] == '{':
+                depth += 1
+            elif text[index] == '}':
+                depth -= 1
+                if depth == 0:
+                    blocks.append(text[match.start():index + 1])
+                    break
+    return blocks
+
+def _local_modules(chdir):
+    """Every local module directory chdir uses, directly or through other local modules"""
+    found = set()
+    pending = [chdir]
+    while pending:
+        for module_dir in parse_module_sources(pending.pop()):
+            if module_dir not in found:
+                found.add(module_dir)
+                pending.append(module_dir)
+    return sorted(found)
+
+def _hash_config(digest, directory, backend):
+    """Hash the parts of a directory's .tf files that decide what init installs"""
+    for path in sorted(glob(os.path.join(directory, "*.tf"))):
+        with open(path) as f:
+            text = f.read()
+        digest.update(os.path.basename(path).encode() + b'\0')
+        if backend:
+            for block in _blocks(_BACKEND_BLOCK, text):
+                digest.update(block.encode() + b'\0')
+        for block in _blocks(_REQUIRED_PROVIDERS_BLOCK, text):
+            digest.update(block.encode() + b'\0')
+        for match in _INSTALL_LINE.finditer(text):
+            digest.update(match.group().strip().encode() + b'\0')
+
+class InitCache:
+    """Shared provider plugin cache and skipping of redundant `terraform init` runs.
+
+    Every directory inits against the same TF_PLUGIN_CACHE_DIR so providers are
+    downloaded once per agent. After a successful init a fingerprint of the lock
+    file, backend config and module/provider sources and requirements (of the
+    directory and every local module it uses) is stored in .terraform/; later
+    runs skip init while it still matches. Terraform does
+    not guarantee the plugin cache is safe for concurrent inits, so inits that
+    do run are serialized.
+    """
+
+    def __init__(self, plugin_cache_dir, provider_mirror=None, force=False):
+        self.plugin_cache_dir = plugin_cache_dir
+        self.provider_mirror = provider_mirror
+        self.force = force
+        self.lock = threading.Lock()
+        self.timings = {}
+        os.makedirs(plugin_cache_dir, exist_ok=True)
+        self.cli_config = self._write_cli_config() if provider_mirror else None
+
+    @classmethod
+    def from_env(cls, force=False):
+        """Build from TF_PLUGIN_CACHE_DIR and TF_PROVIDER_MIRROR"""
+        return cls(
+            os.path.abspath(os.path.expanduser(os.getenv("TF_PLUGIN_CACHE_DIR", "~/.terraform.d/plugin-cache"))),
+            provider_mirror=os.getenv("TF_PROVIDER_MIRROR"),
+            force=force,
+        )
+
+    def _write_cli_config(self):
+        """Point provider installation at a filesystem mirror instead of the registry"""
+        path = os.path.join(self.plugin_cache_dir, ".mirror.tfrc")
+        with open(path, 'w') as f:
+            f.write(
+                "provider_installation {\n"
+                f"  filesystem_mirror {{\n    path = \"{os.path.abspath(self.provider_mirror)}\"\n  }}\n"
+                "}\n"
+            )
+        return path
+
+    def env(self):
+        """Environment for terraform init"""
+        env = {"TF_PLUGIN_CACHE_DIR": self.plugin_cache_dir}
+        if self.cli_config:
+            env["TF_CLI_CONFIG_FILE"] = self.cli_config
+        return env
+
+    def fingerprint(self, chdir):
+        digest = hashlib.sha256()
+        lock_file = os.path.join(chdir, ".terraform.lock.hcl")
+        if os.path.exists(lock_file):
+            with open(lock_file, 'rb') as f:
+                digest.update(f.read())
+        _hash_config(digest, chdir, backend=True)
+        # Nested modules and provider requirements of local modules are installed by init too
+        for module_dir in _local_modules(chdir):
+            digest.update(os.path.relpath(module_dir, chdir).encode() + b'\0')
+            _hash_config(digest, module_dir, backend=False)
+        digest.update(str(sorted(self.env().items())).encode())
+        return digest.hexdigest()
+
+    def is_fresh(self, chdir):
+        """True when the last successful init of chdir still matches its configuration"""
+        if self.force:
+            return False
+        try:
+            with open(os.path.join(chdir, STAMP_FILE)) as f:
+                return f.read().strip() == self.fingerprint(chdir)
+        except OSError:
+            return False
+
+    def mark(self, chdir):
+        """Record a successful init of chdir"""
+        with open(os.path.join(chdir, STAMP_FILE), 'w') as f:
+            f.write(self.fingerprint(chdir))
+
+    def record(self, chdir, seconds, skipped):
+        self.timings[chdir] = (seconds, skipped)
+
+    def report(self):
+        """Per-directory init times as printable lines"""
+        lines = ["Init times:"]
+        for chdir, (seconds, skipped) in sorted(self.timings.items(), key=lambda item: -item[1][0]):
+            lines.append(f"  {chdir}: {'skipped (unchanged)' if skipped else f'{seconds:.1f}s'}")
+        ran = [seconds for seconds, skipped in self.timings.values() if not skipped]
+        lines.append(f"  total: {sum(ran):.1f}s for {len(ran)} init(s), {len(self.timings) - len(ran)} skipped")
+        return lines
@@ -0,0 +1,174 @@
+import os
+import csv
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+REPORT_FIELDS = ["directory", "workspace", "stage", "wall_time", "cpu_time", "output_bytes", "resource_changes",
+                 "max_rss_kb", "py_peak_bytes"]
+
+# Stage being recorded on this thread, so nested code can attach counters with note()
+_current = threading.local()
+
+class Stage:
+    """Measurements of one stage, filled in while it runs"""
+
+    def __init__(self, stage, directory, workspace):
+        self.stage = stage
+        self.directory = directory
+        self.workspace = workspace
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.output_bytes = 0
+        self.resource_changes = None
+        self.max_rss_kb = 0
+        self.py_peak_bytes = None
+
+    def add(self, result):
+        """Account a CommandResult from the executor to this stage"""
+        self.cpu_time += result.cpu_time
+        self.output_bytes += result.stdout_bytes
+        self.max_rss_kb = max(self.max_rss_kb, result.max_rss_kb)
+        return result
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in REPORT_FIELDS}
+
+def note(**values):
+    """Set fields (e.g. resource_changes) on the stage running on this thread, if any"""
+    stage = getattr(_current, "stage", None)
+    if stage is not None:
+        for key, value in values.items():
+            setattr(stage, key, value)
+
+def record_command(result):
+    """Account a command result to the stage running on this thread, if any"""
+    stage = getattr(_current, "stage", None)
+    if stage is not None:
+        stage.add(result)
+    return result
+
+class StageRecorder:
+    """Collects wall time, CPU time, output size and resource counts per stage.
+
+    CPU time is the recorder thread's own CPU (Python stages) plus the CPU of
+    every command run inside the stage, so it stays per-job with parallel
+    workers. `profile` may be "cprofile", which writes one .pstats file per
+    Python stage, or "tracemalloc", which records the Python heap peak of each
+    Python stage (process wide, so only exact with one worker).
+    """
+
+    def __init__(self, profile=None, profile_dir="."):
+        self.stages = []
+        self.lock = threading.Lock()
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self.profiles = {}
+        self.started = time.monotonic()
+        if profile == "tracemalloc":
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, directory="", workspace="", python=False):
+        """Measure a block; `python=True` marks stages that are profiled when profiling is on"""
+        stage = Stage(name, directory, workspace)
+        previous = getattr(_current, "stage", None)
+        _current.stage = stage
+        profiler = None
+        if python and self.profile == "cprofile":
+            # The profilers are only imported when profiling is on, to keep startup fast
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        if python and self.profile == "tracemalloc":
+            import tracemalloc
+            tracemalloc.reset_peak()
+        wall_start = time.monotonic()
+        cpu_start = time.thread_time()
+        try:
+            yield stage
+        finally:
+            stage.wall_time = time.monotonic() - wall_start
+            stage.cpu_time += time.thread_time() - cpu_start
+            if profiler is not None:
+                profiler.disable()
+                self._merge_profile(name, profiler)
+            if python and self.profile == "tracemalloc":
+                import tracemalloc
+                stage.py_peak_bytes = tracemalloc.get_traced_memory()[1]
+            _current.stage = previous
+            with self.lock:
+                self.stages.append(stage)
+
+    def add(self, stage):
+        """Record a stage that was measured elsewhere, e.g. in a worker process"""
+        with self.lock:
+            self.stages.append(stage)
+
+    def _merge_profile(self, name, profiler):
+        import pstats
+        with self.lock:
+            if name in self.profiles:
+                self.profiles[name].add(profiler)
+            else:
+                self.profiles[name] = pstats.Stats(profiler)
+
+    def write_report(self, folder):
+        """Write run_report.json and run_report.csv (plus profiles) to folder, returning the JSON path"""
+        os.makedirs(folder, exist_ok=True)
+        rows = [stage.as_dict() for stage in self.stages]
+        report = {
+            "total_wall_time": time.monotonic() - self.started,
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "children_max_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+            "stages": rows,
+        }
+        json_path = os.path.join(folder, "run_report.json")
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        with open(os.path.join(folder, "run_report.csv"), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        for name, stats in self.profiles.items():
+            stats.dump_stats(os.path.join(self.profile_dir, f"profile_{name}.pstats"))
+        return json_path
+
+def load_report(path):
+    """Read a run_report.json, or None when there is none"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def timing_table(report, limit=10):
+    """Markdown table of the slowest directory/workspace jobs in a run report"""
+    jobs = {}
+    for row in report.get("stages", []):
+        if not row.get("directory"):
+            continue
+        job = jobs.setdefault((row["directory"], row.get("workspace", "")), {"total": 0.0, "plan": 0.0, "post": 0.0, "json": 0})
+        job["total"] += row["wall_time"]
+        if row["stage"] in ("plan", "show_json"):
+            job["plan"] += row["wall_time"]
+        elif row["stage"] in ("terraform_j2md", "process_file", "filter_plan_json"):
+            job["post"] += row["wall_time"]
+        if row["stage"] == "show_json":
+            job["json"] = row["output_bytes"]
+    if not jobs:
+        return ""
+
+    lines = [
+        "| Directory | Workspace | Total | Plan | Post-processing | Plan JSON |",
+        "|-----------|-----------|-------|------|-----------------|-----------|",
+    ]
+    slowest = sorted(jobs.items(), key=lambda item: -item[1]["total"])[:limit]
+    for (directory, workspace), job in slowest:
+        lines.append(f"| {directory} | {workspace or '-'} | {job['total']:.1f}s | {job['plan']:.1f}s | "
+                     f"{job['post']:.1f}s | {job['json'] / 1048576:.1f} MB |")
+    return "\n".join(lines)
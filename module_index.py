@@ -0,0 +1,164 @@
+import os
+import re
+import json
+import executor
+
+INDEX_VERSION = 1
+
+_MODULE_BLOCK = re.compile(r'^\s*module\s+"[^"]*"\s*\{', re.MULTILINE)
+_SOURCE = re.compile(r'^\s*source\s*=\s*"([^"]+)"', re.MULTILINE)
+
+def _block_at(text, start):
+    """Return the text of the brace block opening at or after `start`"""
+    depth = 0
+    for index in range(text.index('{', start), len(text)):
+        if text[index] == '{':
+            depth += 1
+        elif text[index] == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1]
+    return text[start:]
+
+def _normalize(path):
+    path = os.path.normpath(path).replace(os.sep, '/')
+    return '' if path == '.' else path
+
+def parse_module_sources(directory):
+    """Return the local module directories used by the .tf files of a directory"""
+    sources = set()
+    try:
+        names = [name for name in os.listdir(directory or '.') if name.endswith('.tf')]
+    except OSError:
+        return sources
+    for name in names:
+        with open(os.path.join(directory, name)) as f:
+            text = f.read()
+        for match in _MODULE_BLOCK.finditer(text):
+            source = _SOURCE.search(_block_at(text, match.start()))
+            # Only local paths can change in this repository; registry/git modules are pinned
+            if source and source.group(1).startswith(('./', '../')):
+                sources.add(_normalize(os.path.join(directory, source.group(1))))
+    return sources
+
+def is_root(directory):
+    """A root directory is one that gets planned: it has at least one .tfvars workspace"""
+    try:
+        return any(name.endswith('.tfvars') for name in os.listdir(directory or '.'))
+    except OSError:
+        return False
+
+class ModuleIndex:
+    """Which directories use which local modules, so a module change plans its consumers.
+
+    `uses` maps a directory to the set of module directories it sources and
+    `used_by` is the reverse map. The index is saved to disk together with the
+    commit it was built at and updated from `git diff` on the next run, so
+    only directories whose .tf files changed are parsed again.
+    """
+
+    def __init__(self, root_dirs, uses=None, commit=None):
+        self.root_dirs = [_normalize(root_dir) for root_dir in root_dirs]
+        self.uses = uses or {}
+        self.commit = commit
+        self._build_reverse()
+
+    def _build_reverse(self):
+        self.used_by = {}
+        for directory, modules in self.uses.items():
+            for module in modules:
+                self.used_by.setdefault(module, set()).add(directory)
+
+    def _scan(self, directories):
+        """Parse directories and, transitively, every local module they reference"""
+        queue = list(directories)
+        seen = set()
+        while queue:
+            directory = queue.pop()
+            if directory in seen:
+                continue
+            seen.add(directory)
+            modules = parse_module_sources(directory)
+            if modules or directory in self.uses:
+                self.uses[directory] = modules
+            queue.extend(module for module in modules if module not in self.uses)
+
+    def build(self):
+        """Scan every directory with .tf files under the root dirs"""
+        self.uses = {}
+        directories = []
+        for root_dir in self.root_dirs:
+            for current, subdirs, files in os.walk(root_dir or '.'):
+                subdirs[:] = [d for d in subdirs if not d.startswith('.')]
+                if any(name.endswith('.tf') for name in files):
+                    directories.append(_normalize(current))
+        self._scan(directories)
+        self._build_reverse()
+
+    def update(self, changed_files):
+        """Re-parse only the directories of changed .tf files"""
+        directories = {_normalize(os.path.dirname(path)) for path in changed_files if path.endswith('.tf')}
+        for directory in directories:
+            self.uses.pop(directory, None)
+        self._scan(directories)
+        self._build_reverse()
+
+    def consumers(self, directory):
+        """All directories that use `directory` as a module, directly or through other modules"""
+        found = set()
+        stack = [directory]
+        while stack:
+            for consumer in self.used_by.get(stack.pop(), ()):
+                if consumer not in found:
+                    found.add(consumer)
+                    stack.append(consumer)
+        return found
+
+    def affected_roots(self, changed_files):
+        """Root directories to plan for a set of changed files"""
+        roots = set()
+        for path in changed_files:
+            parts = path.split('/')
+            if "template" in parts or os.path.splitext(path)[1] not in ('.tf', '.tfvars'):
+                continue
+            directory = _normalize(os.path.dirname(path))
+            for candidate in {directory} | self.consumers(directory):
+                if is_root(candidate):
+                    roots.add(candidate)
+        return roots
+
+    def save(self, path, commit):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({
+                "version": INDEX_VERSION,
+                "commit": commit,
+                "root_dirs": self.root_dirs,
+                "uses": {directory: sorted(modules) for directory, modules in self.uses.items()},
+            }, f)
+
+    @classmethod
+    def load(cls, path, root_dirs, head):
+        """Load the saved index and bring it up to `head`, or build it from scratch"""
+        index = cls(root_dirs)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+
+        if data and data.get("version") == INDEX_VERSION and data.get("root_dirs") == index.root_dirs:
+            index.uses = {directory: set(modules) for directory, modules in data["uses"].items()}
+            index.commit = data.get("commit")
+            if index.commit == head:
+                index._build_reverse()
+                return index
+            diff = executor.run(["git", "diff", "--name-only", "--relative", index.commit, head, "."], echo=False)
+            if diff.ok:
+                index.update(line.strip() for line in diff.output)
+                index.commit = head
+                return index
+
+        index.build()
+        index.commit = head
+        return index
@@ -0,0 +1,192 @@
+import os
+import re
+import json
+from plan_diff import diff_values
+
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configurations", "noise_rules.json")
+
+RESOURCE_EFFECTS = ("ignore", "collapse", "count")
+ATTRIBUTE_EFFECTS = ("ignore", "count")
+
+def _translate(pattern):
+    """Regex for a glob where only * is special, since addresses and paths contain brackets"""
+    return ".*".join(re.escape(part) for part in pattern.split("*"))
+
+def attribute_regex(pattern):
+    """Regex for an attribute path glob that also matches everything below the attribute it names"""
+    return _translate(pattern) + r"(?:[.\[].*)?"
+
+def _as_list(value):
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+def action_name(actions):
+    """create, update, delete, replace, read or no-op for a terraform action list"""
+    if sorted(actions) == ['create', 'delete']:
+        return 'replace'
+    return actions[0] if len(actions) == 1 else 'no-op'
+
+def resource_name(address):
+    """The name of a resource address without module path or index, e.g. alert_1 for module.a.t.alert_1[0]"""
+    name = address.split('.')[-1]
+    return name.split('[')[0]
+
+class Rule:
+    """One noise rule from the rules file.
+
+    A rule without `attribute` acts on whole resource changes: `ignore` drops
+    them, `collapse` drops them and counts unique resource names, `count`
+    only counts them. A rule with `attribute` acts on the changed attribute
+    paths of updates: `ignore` leaves matching paths out of the change (and
+    drops updates where nothing else changed), `count` only counts them.
+    """
+
+    def __init__(self, index, name, effect, type=None, address=None, action=None, attribute=None, summary=None):
+        self.index = index
+        self.name = name
+        self.effect = effect
+        self.types = set(_as_list(type))
+        self.actions = set(_as_list(action))
+        self.attributes = _as_list(attribute)
+        effects = ATTRIBUTE_EFFECTS if self.attributes else RESOURCE_EFFECTS
+        if effect not in effects:
+            raise ValueError(f"Noise rule {name}: effect must be one of {', '.join(effects)}, not {effect!r}")
+        self.address = re.compile(_translate(address) + r"\Z") if address else None
+        self.attribute_regex = "|".join(attribute_regex(pattern) for pattern in self.attributes)
+        # Plain top-level keys can also be removed from the `after` of kept changes
+        self.top_level_keys = [pattern for pattern in self.attributes if re.fullmatch(r"[A-Za-z0-9_\-]+", pattern)]
+        if summary is None:
+            summary = f"{{count}} {name}" + (" ({only} only)" if self.attributes and effect == "ignore" else "")
+        self.summary = summary
+
+    def applies(self, address, action):
+        if self.actions and action not in self.actions:
+            return False
+        return self.address is None or self.address.match(address) is not None
+
+class RuleStats:
+    """What the rules matched in one plan"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.counts = {rule.name: 0 for rule in rules}
+        self.only = {rule.name: 0 for rule in rules if rule.attributes and rule.effect == "ignore"}
+        self.unique = {rule.name: set() for rule in rules if rule.effect == "collapse"}
+
+    def count(self, rule):
+        return len(self.unique[rule.name]) if rule.name in self.unique else self.counts[rule.name]
+
+    def summary_lines(self):
+        """One line per rule that matched anything, in rules file order"""
+        return [rule.summary.format(count=self.count(rule), only=self.only.get(rule.name, 0))
+                for rule in self.rules if self.count(rule)]
+
+    def as_dict(self):
+        values = {}
+        for rule in self.rules:
+            values[rule.name] = self.count(rule)
+            if rule.name in self.only:
+                values[f"{rule.name}_only"] = self.only[rule.name]
+        return values
+
+class NoiseRules:
+    """Rules compiled into per-type lookups, so a change is only checked against the rules that can match it"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._resource_rules = {}
+        self._attribute_rules = {}
+        self._attribute_patterns = {}
+
+    @classmethod
+    def load(cls, path=None):
+        """Load the rules file (NOISE_RULES_FILE or configurations/noise_rules.json)"""
+        path = path or os.getenv("NOISE_RULES_FILE") or DEFAULT_RULES_FILE
+        with open(path) as f:
+            data = json.load(f)
+        names = set()
+        rules = []
+        for index, options in enumerate(data.get("rules", [])):
+            rule = Rule(index, **options)
+            if rule.name in names:
+                raise ValueError(f"Duplicate noise rule name: {rule.name}")
+            names.add(rule.name)
+            rules.append(rule)
+        return cls(rules)
+
+    def new_stats(self):
+        return RuleStats(self.rules)
+
+    def _for_type(self, cache, resource_type, attribute):
+        rules = cache.get(resource_type)
+        if rules is None:
+            rules = [rule for rule in self.rules
+                     if bool(rule.attributes) == attribute and (not rule.types or resource_type in rule.types)]
+            cache[resource_type] = rules
+        return rules
+
+    def _attribute_pattern(self, rules):
+        """One alternation over the attribute globs of these rules; the matching group names the rule"""
+        key = tuple(rule.index for rule in rules)
+        pattern = self._attribute_patterns.get(key)
+        if pattern is None:
+            pattern = re.compile("|".join(f"(?P<r{rule.index}>{rule.attribute_regex})" for rule in rules) + r"\Z")
+            self._attribute_patterns[key] = pattern
+        return pattern
+
+    def apply(self, change, stats):
+        """Apply the rules to one resource change, recording matches in stats.
+
+        Returns False when the change should be left out of the clean plan.
+        Updates that are kept get `simplified_changes` with their remaining
+        changed attributes, unless sensitive values changed.
+        """
+        resource_type = change.get('type', '')
+        address = change.get('address', '')
+        details = change.get('change', {})
+        action = action_name(details.get('actions', []))
+
+        for rule in self._for_type(self._resource_rules, resource_type, False):
+            if not rule.applies(address, action):
+                continue
+            if rule.effect == "collapse":
+                stats.unique[rule.name].add(resource_name(address))
+                return False
+            stats.counts[rule.name] += 1
+            if rule.effect == "ignore":
+                return False
+
+        attribute_rules = [rule for rule in self._for_type(self._attribute_rules, resource_type, True)
+                           if rule.applies(address, action)]
+        if action == 'update':
+            pattern = self._attribute_pattern(attribute_rules) if attribute_rules else None
+            matched = set()
+            simplified_changes = {}
+            for path, old, new in diff_values(details.get('before') or {}, details.get('after') or {}):
+                match = pattern.match(path) if pattern else None
+                if match:
+                    rule = self.rules[int(match.lastgroup[1:])]
+                    matched.add(rule)
+                    if rule.effect == "ignore":
+                        continue
+                simplified_changes[path] = {"before": old, "after": new}
+            for rule in matched:
+                stats.counts[rule.name] += 1
+
+            ignored = [rule for rule in matched if rule.effect == "ignore"]
+            if ignored and not simplified_changes:
+                for rule in ignored:
+                    stats.only[rule.name] += 1
+                return False
+            # Only show attribute values when no sensitive values are involved
+            if simplified_changes and details.get('before_sensitive') == details.get('after_sensitive'):
+                details['simplified_changes'] = simplified_changes
+
+        after = details.get('after')
+        if isinstance(after, dict):
+            for rule in attribute_rules:
+                if rule.effect == "ignore":
+                    for key in rule.top_level_keys:
+                        after.pop(key, None)
+        return True
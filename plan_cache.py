@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+from glob import glob
+
+DEFAULT_TTL = 6 * 60 * 60
+DEFAULT_MAX_ENTRIES = 200
+
+# Files whose content decides the plan of a directory
+INPUT_PATTERNS = ("*.tf", "*.tf.json", "*.tfvars", ".terraform.lock.hcl")
+
+# Bump when the cached artifacts change in a way the processing files don't show
+CACHE_FORMAT = 1
+
+def _hash_file(digest, path):
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+def _hash_tree(digest, directory):
+    """Hash the terraform inputs of a directory, in a stable order"""
+    paths = sorted({path for pattern in INPUT_PATTERNS for path in glob(os.path.join(directory, pattern))})
+    for path in paths:
+        digest.update(os.path.relpath(path, directory).encode() + b'\0')
+        _hash_file(digest, path)
+        digest.update(b'\0')
+
+def _local_module_dirs(chdir):
+    """Return local module directories recorded by terraform init in modules.json"""
+    manifest = os.path.join(chdir, ".terraform", "modules", "modules.json")
+    if not os.path.exists(manifest):
+        return []
+    with open(manifest) as f:
+        modules = json.load(f).get("Modules", [])
+    dirs = []
+    for module in modules:
+        module_dir = module.get("Dir", "")
+        # Registry/git modules are downloaded under .terraform/modules and pinned by
+        # their source in modules.json; only local paths need their content hashed
+        if module.get("Key") and not module_dir.startswith(".terraform"):
+            dirs.append(os.path.normpath(os.path.join(chdir, module_dir)))
+    return sorted(set(dirs))
+
+def processing_key(paths, settings=""):
+    """Hash the code, configuration files and settings that turn a plan into the cached artifacts"""
+    digest = hashlib.sha256(f"{CACHE_FORMAT}\0{settings}\0".encode())
+    for path in paths:
+        _hash_file(digest, path)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+class PlanCache:
+    """Local cache of plan artifacts keyed on a hash of everything a plan depends on.
+
+    Entries live in `cache_dir/<key>/` and expire after `ttl` seconds, since
+    remote state can drift even when the code has not changed. At most
+    `max_entries` are kept; the least recently used are evicted first.
+    `processing` (see processing_key) is part of every key, since the cached
+    clean text, summary and markdown depend on the rules and code that made them.
+    """
+
+    def __init__(self, cache_dir, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, enabled=True, processing=""):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.processing = processing
+        if enabled:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, artifact_folder, bypass=False, processing=""):
+        """Build the cache from PLAN_CACHE_* environment variables"""
+        bypass = bypass or os.getenv("PLAN_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+        return cls(
+            os.getenv("PLAN_CACHE_DIR", os.path.join(artifact_folder, ".plan_cache")),
+            ttl=int(os.getenv("PLAN_CACHE_TTL", DEFAULT_TTL)),
+            max_entries=int(os.getenv("PLAN_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+            enabled=not bypass,
+            processing=processing,
+        )
+
+    def key(self, chdir, workspace, provider_versions=""):
+        """Hash the directory inputs, its local modules, the workspace, provider versions and processing"""
+        digest = hashlib.sha256()
+        digest.update(f"{self.processing}\0{chdir}\0{workspace}\0{provider_versions}\0".encode())
+        _hash_tree(digest, chdir)
+        manifest = os.path.join(chdir, ".terraform", "modules", "modules.json")
+        if os.path.exists(manifest):
+            _hash_file(digest, manifest)
+        for module_dir in _local_module_dirs(chdir):
+            digest.update(module_dir.encode() + b'\0')
+            _hash_tree(digest, module_dir)
+        return digest.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def restore(self, key, artifacts):
+        """Copy a cached entry to the `artifacts` {name: destination} paths.
+
+        Entries stored with no_changes=True may hold fewer artifacts than
+        requested, since a plan without changes has no JSON or markdown; only
+        the ones they were stored with are copied. Returns the entry's
+        metadata on a hit, otherwise None.
+        """
+        if not self.enabled:
+            return False
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, "meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - meta.get("created", 0) > self.ttl:
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        names = set(meta.get("artifacts", artifacts))
+        if not names <= set(artifacts) or (names != set(artifacts) and not meta.get("no_changes")):
+            return None
+        if not all(os.path.exists(os.path.join(entry, name)) for name in names):
+            return None
+        for name in names:
+            shutil.copyfile(os.path.join(entry, name), artifacts[name])
+        # Mark as recently used for eviction
+        os.utime(entry)
+        return meta
+
+    def store(self, key, artifacts, **meta):
+        """Save the `artifacts` {name: source} files under `key`"""
+        if not self.enabled or os.path.exists(self._entry(key)):
+            return
+        staging = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            for name, source in artifacts.items():
+                shutil.copyfile(source, os.path.join(staging, name))
+            with open(os.path.join(staging, "meta.json"), 'w') as f:
+                json.dump(dict(meta, created=time.time(), artifacts=sorted(artifacts)), f)
+            # Publish atomically so concurrent jobs never see a partial entry
+            os.rename(staging, self._entry(key))
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def evict(self):
+        """Remove expired entries, then the least recently used ones above max_entries"""
+        if not self.enabled:
+            return
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(path):
+                continue
+            if name.startswith(".tmp-") or now - os.path.getmtime(path) > self.ttl:
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                entries.append((os.path.getmtime(path), path))
+        entries.sort(reverse=True)
+        for _, path in entries[self.max_entries:]:
+            shutil.rmtree(path, ignore_errors=True)
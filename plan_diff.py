@@ -0,0 +1,109 @@
+import json
+import re
+
+# Keys used to align lists of blocks (e.g. ip_restriction, connection_string)
+# by identity instead of by position
+LIST_IDENTITY_KEYS = ("name", "key", "id")
+
+_PLAIN_KEY = re.compile(r'^[A-Za-z_][A-Za-z0-9_\-]*$')
+
+def _join(path, key):
+    if _PLAIN_KEY.match(key):
+        return f"{path}.{key}" if path else key
+    return f"{path}[{json.dumps(key)}]"
+
+def _fingerprint(value):
+    """Cheap canonical hash used to match identical list elements"""
+    return hash(json.dumps(value, sort_keys=True, default=str))
+
+def _identity_key(before, after):
+    """Return a key that uniquely identifies every dict element of both lists, if any"""
+    items = before + after
+    if not items or not all(isinstance(item, dict) for item in items):
+        return None
+    for key in LIST_IDENTITY_KEYS:
+        for values in ([item.get(key) for item in before], [item.get(key) for item in after]):
+            if None in values or not all(isinstance(v, (str, int)) for v in values) or len(set(values)) != len(values):
+                break
+        else:
+            return key
+    return None
+
+def diff_values(before, after, path=""):
+    """Yield (path, before, after) for every minimal changed leaf between two values.
+
+    Each child is compared once, with `!=` in C, before descending into it:
+    unchanged subtrees are skipped without walking them in Python, and a
+    changed one is only compared up to its first difference. Paths look like
+    `site_config[0].app_settings.FOO`; lists of blocks that carry a name/key/id
+    are aligned by it and addressed as `ip_restriction[name=office]`.
+    """
+    if before is not after and before != after:
+        yield from _diff(before, after, path)
+
+def _diff(before, after, path):
+    # The caller has already found before and after to differ
+    if isinstance(before, dict) and isinstance(after, dict):
+        for key, old in before.items():
+            if key in after:
+                new = after[key]
+                if old is not new and old != new:
+                    yield from _diff(old, new, _join(path, key))
+            elif old is not None:
+                yield _join(path, key), old, None
+        for key, new in after.items():
+            if key not in before and new is not None:
+                yield _join(path, key), None, new
+    elif isinstance(before, list) and isinstance(after, list):
+        yield from _diff_lists(before, after, path)
+    else:
+        yield path, before, after
+
+def _diff_lists(before, after, path):
+    # Blocks with a name/key/id are aligned by it, so reordering them is not a change
+    key = _identity_key(before, after)
+    if key is not None:
+        after_by_key = {item[key]: item for item in after}
+        before_keys = set()
+        for old in before:
+            before_keys.add(old[key])
+            element_path = f"{path}[{key}={old[key]}]"
+            if old[key] in after_by_key:
+                new = after_by_key[old[key]]
+                if old != new:
+                    yield from _diff(old, new, element_path)
+            else:
+                yield element_path, old, None
+        for new in after:
+            if new[key] not in before_keys:
+                yield f"{path}[{key}={new[key]}]", None, new
+        return
+
+    if len(before) == len(after):
+        # Same shape: compare element-wise, the common case for nested blocks
+        for index, (old, new) in enumerate(zip(before, after)):
+            if old != new:
+                yield from _diff(old, new, f"{path}[{index}]")
+        return
+
+    # Different lengths without an identity key: drop elements present on both
+    # sides, then pair up what is left by position
+    after_hashes = {}
+    for index, new in enumerate(after):
+        after_hashes.setdefault(_fingerprint(new), []).append(index)
+    matched_after = set()
+    removed = []
+    for index, old in enumerate(before):
+        candidates = after_hashes.get(_fingerprint(old))
+        if candidates:
+            matched_after.add(candidates.pop(0))
+        else:
+            removed.append(index)
+    added = [index for index in range(len(after)) if index not in matched_after]
+
+    for old_index, new_index in zip(removed, added):
+        yield from diff_values(before[old_index], after[new_index], f"{path}[{new_index}]")
+    for old_index in removed[len(added):]:
+        yield f"{path}[{old_index}]", before[old_index], None
+    for new_index in added[len(removed):]:
+        yield f"{path}[{new_index}]", None, after[new_index]
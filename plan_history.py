@@ -0,0 +1,165 @@
+"""Append-only history of plan results across builds, kept in SQLite.
+
+    python plan_history.py slowest --days 30
+    python plan_history.py drift --builds 5
+    python plan_history.py growth --days 30
+"""
+import os
+import time
+import sqlite3
+import argparse
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    id INTEGER PRIMARY KEY,
+    build TEXT NOT NULL,
+    recorded REAL NOT NULL,
+    directory TEXT NOT NULL,
+    workspace TEXT NOT NULL,
+    cached INTEGER NOT NULL DEFAULT 0,
+    no_changes INTEGER NOT NULL DEFAULT 0,
+    plan_seconds REAL,
+    json_bytes INTEGER,
+    add_count INTEGER NOT NULL DEFAULT 0,
+    change_count INTEGER NOT NULL DEFAULT 0,
+    delete_count INTEGER NOT NULL DEFAULT 0,
+    replace_count INTEGER NOT NULL DEFAULT 0,
+    risk_score REAL
+);
+CREATE INDEX IF NOT EXISTS plans_recorded ON plans (recorded);
+CREATE INDEX IF NOT EXISTS plans_workspace ON plans (directory, workspace, id);
+
+CREATE TABLE IF NOT EXISTS changed_resources (
+    plan INTEGER NOT NULL REFERENCES plans (id),
+    address TEXT NOT NULL,
+    action TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changed_resources_plan ON changed_resources (plan);
+CREATE INDEX IF NOT EXISTS changed_resources_address ON changed_resources (address);
+"""
+
+DAY = 24 * 60 * 60
+
+class PlanHistory:
+    """Plan results of every build, for trends such as slow directories, perpetual drift and growing plans.
+
+    One row is appended per planned (or cache-restored) workspace, with the
+    addresses it changed. Rows are never updated or removed, so concurrent
+    builds on the same agent only ever append. `build` is BUILD_BUILDID when
+    running in Azure DevOps, otherwise the time the history was opened.
+    """
+
+    def __init__(self, path, build=None, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.build = build or os.getenv("BUILD_BUILDID") or time.strftime("%Y%m%dT%H%M%S")
+        self.lock = threading.Lock()
+        self.db = None
+        if enabled:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # Plans are recorded from the scheduler's worker threads, serialized by the lock
+            self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.db.executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls, artifact_folder):
+        """Build from PLAN_HISTORY_DB; `none` turns the history off"""
+        path = os.getenv("PLAN_HISTORY_DB", os.path.join(artifact_folder, ".plan_history.sqlite"))
+        return cls(path, enabled=path.lower() != "none")
+
+    def record(self, directory, workspace, summary, plan_seconds=None, json_bytes=None, cached=False):
+        """Append one plan from its parsed _summary.json"""
+        if not self.enabled:
+            return
+        counts = summary.get('counts', {})
+        risk = summary.get('risk') or {}
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "INSERT INTO plans (build, recorded, directory, workspace, cached, no_changes, plan_seconds, json_bytes,"
+                " add_count, change_count, delete_count, replace_count, risk_score)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.build, time.time(), directory, workspace, int(cached), int(summary.get('no_changes', False)),
+                 plan_seconds, json_bytes, counts.get('add', 0), counts.get('change', 0), counts.get('delete', 0),
+                 counts.get('replace', 0), risk.get('score')))
+            self.db.executemany("INSERT INTO changed_resources (plan, address, action) VALUES (?, ?, ?)",
+                                ((cursor.lastrowid, change['address'], change['action']) for change in summary.get('changes', [])))
+
+    def slowest_directories(self, days=30, limit=10):
+        """(directory, plans, average and maximum plan seconds) of terraform plans run in the last `days` days"""
+        return self.db.execute(
+            "SELECT directory, COUNT(*), AVG(plan_seconds), MAX(plan_seconds) FROM plans"
+            " WHERE recorded >= ? AND plan_seconds IS NOT NULL"
+            " GROUP BY directory ORDER BY AVG(plan_seconds) DESC LIMIT ?",
+            (time.time() - days * DAY, limit)).fetchall()
+
+    def perpetual_drift(self, builds=5, limit=50):
+        """(directory, workspace, address) changed in each of the last `builds` plans of its workspace.
+
+        Only plans terraform actually ran count: a cache hit replays an earlier plan.
+        """
+        return self.db.execute(
+            "WITH recent AS ("
+            "  SELECT id, directory, workspace FROM ("
+            "    SELECT id, directory, workspace,"
+            "           ROW_NUMBER() OVER (PARTITION BY directory, workspace ORDER BY id DESC) AS age"
+            "    FROM plans WHERE cached = 0"
+            "  ) WHERE age <= :builds"
+            ")"
+            " SELECT recent.directory, recent.workspace, changed_resources.address FROM changed_resources"
+            " JOIN recent ON changed_resources.plan = recent.id"
+            " GROUP BY recent.directory, recent.workspace, changed_resources.address"
+            " HAVING COUNT(DISTINCT recent.id) = :builds"
+            " ORDER BY recent.directory, recent.workspace, changed_resources.address LIMIT :limit",
+            {"builds": builds, "limit": limit}).fetchall()
+
+    def size_growth(self, days=30, limit=10):
+        """(directory, workspace, first and last plan JSON bytes) over the last `days` days, fastest growing first"""
+        rows = self.db.execute(
+            "WITH sized AS (SELECT id, directory, workspace, json_bytes FROM plans"
+            "               WHERE recorded >= ? AND json_bytes IS NOT NULL AND cached = 0)"
+            " SELECT directory, workspace,"
+            "   (SELECT json_bytes FROM sized AS first WHERE first.directory = sized.directory"
+            "      AND first.workspace = sized.workspace ORDER BY id LIMIT 1),"
+            "   (SELECT json_bytes FROM sized AS last WHERE last.directory = sized.directory"
+            "      AND last.workspace = sized.workspace ORDER BY id DESC LIMIT 1)"
+            " FROM sized GROUP BY directory, workspace",
+            (time.time() - days * DAY,)).fetchall()
+        return sorted(rows, key=lambda row: -(row[3] / row[2] if row[2] else 0))[:limit]
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the plan history recorded by tfplan.py.')
+    parser.add_argument('query', choices=['slowest', 'drift', 'growth'])
+    parser.add_argument('--db', default=os.getenv("PLAN_HISTORY_DB",
+                                                  os.path.join(os.getenv("ARTIFACT_FOLDER", "default_artifact_folder"), ".plan_history.sqlite")))
+    parser.add_argument('--days', type=int, default=30, help='Window for slowest and growth (default: 30)')
+    parser.add_argument('--builds', type=int, default=5, help='Consecutive plans a resource must change in for drift (default: 5)')
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"No plan history at {args.db}")
+    history = PlanHistory(args.db)
+    try:
+        if args.query == 'slowest':
+            print("| Directory | Plans | Average | Max |\n|-----------|-------|---------|-----|")
+            for directory, plans, average, longest in history.slowest_directories(args.days, args.limit):
+                print(f"| {directory} | {plans} | {average:.1f}s | {longest:.1f}s |")
+        elif args.query == 'drift':
+            print("| Directory | Workspace | Resource |\n|-----------|-----------|----------|")
+            for directory, workspace, address in history.perpetual_drift(args.builds, args.limit):
+                print(f"| {directory} | {workspace} | {address} |")
+        else:
+            print("| Directory | Workspace | First | Last | Growth |\n|-----------|-----------|-------|------|--------|")
+            for directory, workspace, first, last in history.size_growth(args.days, args.limit):
+                growth = f"{(last / first - 1) * 100:+.0f}%" if first else "-"
+                print(f"| {directory} | {workspace} | {first / 1048576:.1f} MB | {last / 1048576:.1f} MB | {growth} |")
+    finally:
+        history.close()
+
+if __name__ == "__main__":
+    main()
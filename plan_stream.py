@@ -0,0 +1,186 @@
+import json
+import re
+
+CHUNK_SIZE = 1 << 16
+
+_STRUCTURAL = re.compile(r'["\[\]{}]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r'[\s,\]}]')
+_WHITESPACE = " \t\r\n"
+
+class PlanReader:
+    """Incremental reader for the top level of a `terraform show -json` document.
+
+    Only one value is decoded at a time, so sections such as prior_state or
+    configuration can be skipped or copied through without ever being held in
+    memory. Usage:
+
+        reader = PlanReader(f)
+        for key in reader.keys():
+            if key == "resource_changes":
+                for change in reader.iter_array():
+                    ...
+            else:
+                reader.copy_value(out)   # or reader.skip_value()
+
+    After each key is yielded, exactly one of read_value, iter_array,
+    copy_value or skip_value must be called to consume its value.
+    """
+
+    def __init__(self, file_obj, chunk_size=CHUNK_SIZE):
+        self.file = file_obj
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _read(self, size=None):
+        """Drop the consumed prefix of the buffer and append the next chunk"""
+        chunk = self.file.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def _skip_ws(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return
+            if self.eof:
+                raise ValueError("Unexpected end of plan JSON")
+            self._read()
+
+    def _next_char(self):
+        self._skip_ws()
+        char = self.buf[self.pos]
+        self.pos += 1
+        return char
+
+    def _expect(self, expected):
+        char = self._next_char()
+        if char != expected:
+            raise ValueError(f"Expected '{expected}' in plan JSON, got '{char}'")
+
+    def read_value(self):
+        """Decode and return the next JSON value"""
+        self._skip_ws()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number cut by the end of the buffer (e.g. at its '.' or 'e') decodes as a
+                # shorter number, so it is only complete once a delimiter follows it
+                if self.eof or isinstance(value, (str, list, dict)) or _SCALAR_END.match(self.buf, end):
+                    break
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Grow the read size so large values are not re-parsed once per chunk
+            self._read(size)
+            size *= 2
+        self.pos = end
+        return value
+
+    def iter_array(self):
+        """Yield the elements of the next JSON array one at a time"""
+        self._expect('[')
+        self._skip_ws()
+        if self.buf[self.pos] == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.read_value()
+            char = self._next_char()
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f"Expected ',' or ']' in plan JSON, got '{char}'")
+
+    def keys(self):
+        """Yield the keys of the top-level object in document order"""
+        self._expect('{')
+        self._skip_ws()
+        if self.buf[self.pos] == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self._expect(':')
+            yield key
+            char = self._next_char()
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError(f"Expected ',' or '}}' in plan JSON, got '{char}'")
+
+    def skip_value(self):
+        """Consume the next JSON value without decoding it"""
+        self.copy_value(None)
+
+    def copy_value(self, out):
+        """Copy the raw text of the next JSON value to `out` without decoding it"""
+        self._skip_ws()
+        start = self.pos
+        depth = 0
+        in_string = False
+
+        if self.buf[self.pos] not in '{["':
+            # Scalar (number, true, false, null)
+            while True:
+                match = _SCALAR_END.search(self.buf, self.pos)
+                if match or self.eof:
+                    self.pos = match.start() if match else len(self.buf)
+                    break
+                start = self._flush(out, start, len(self.buf))
+            if out is not None:
+                out.write(self.buf[start:self.pos])
+            return
+
+        while True:
+            if in_string:
+                match = _STRING_SPECIAL.search(self.buf, self.pos)
+                if match is None:
+                    start = self._flush(out, start, len(self.buf))
+                    continue
+                if match.group() == '\\':
+                    if match.end() >= len(self.buf):
+                        # Escape split across chunks, keep the backslash for the next read
+                        start = self._flush(out, start, match.start())
+                        continue
+                    self.pos = match.end() + 1
+                    continue
+                in_string = False
+                self.pos = match.end()
+                if depth == 0:
+                    break
+            else:
+                match = _STRUCTURAL.search(self.buf, self.pos)
+                if match is None:
+                    start = self._flush(out, start, len(self.buf))
+                    continue
+                self.pos = match.end()
+                char = match.group()
+                if char == '"':
+                    in_string = True
+                elif char in '{[':
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        break
+
+        if out is not None:
+            out.write(self.buf[start:self.pos])
+
+    def _flush(self, out, start, end):
+        """Write buf[start:end] to out, then read more data. Returns the new start offset"""
+        if self.eof:
+            raise ValueError("Unexpected end of plan JSON")
+        if out is not None:
+            out.write(self.buf[start:end])
+        self.pos = end
+        self._read()
+        return 0
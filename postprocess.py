@@ -0,0 +1,54 @@
+import os
+
+def get_postprocess_workers(cli_value=None):
+    """Resolve the pool size from the CLI flag, POSTPROCESS_WORKERS or min(4, CPUs); 0 runs in-process"""
+    value = cli_value if cli_value is not None else os.getenv("POSTPROCESS_WORKERS", min(4, os.cpu_count() or 1))
+    try:
+        return max(0, int(value))
+    except ValueError:
+        raise ValueError(f"Invalid post-processing worker count: {value}")
+
+class PostProcessor:
+    """Run CPU-bound plan processing in a process pool shared by every workspace job.
+
+    A job submits its work and carries on (e.g. with terraform-j2md, or the
+    next workspace's plan); `wait()` collects the results at the end of the
+    run and hands each one to its callback on the calling thread. With no
+    workers the function runs immediately on the submitting thread.
+    """
+
+    def __init__(self, workers=0):
+        self.pool = None
+        if workers:
+            # Imported here: in-process runs don't need multiprocessing at all
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # spawn rather than fork: the scheduler's worker threads may hold locks
+            self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self.pending = []
+
+    @property
+    def in_process(self):
+        return self.pool is None
+
+    def submit(self, func, args, on_done):
+        """Run func(*args) and later on_done(result), or on_done(None) if the job crashed"""
+        if self.pool is None:
+            on_done(func(*args))
+        else:
+            self.pending.append((self.pool.submit(func, *args), on_done))
+
+    def wait(self):
+        """Wait for all submitted work and run the callbacks in submission order"""
+        for future, on_done in self.pending:
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Post-processing job failed: {e}", flush=True)
+                result = None
+            on_done(result)
+        self.pending = []
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
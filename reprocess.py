@@ -0,0 +1,153 @@
+"""Re-run the filtering and rendering stages on existing plans, without init, plan or credentials.
+
+    python reprocess.py archived/ --output reprocessed
+    python reprocess.py 'artifacts/**/*.json' --comment
+
+Takes plan JSON files (`terraform show -json` output) or binary .tfplan files,
+which need terraform and the initialized directory they were planned in, and
+writes the clean text, clean JSON, summary and markdown of each one to the
+output folder, processing files in parallel.
+"""
+import os
+import sys
+import glob
+import shutil
+import argparse
+import executor
+import tfplan
+from postprocess import PostProcessor
+from scheduler import bind_log, log
+
+# Files written next to plans by earlier runs, which are not plans themselves
+DERIVED_SUFFIXES = ("_clean.json", "_summary.json", "_clean.ndjson", "_split.json")
+NON_PLAN_FILES = {"run_report.json", "pr_comment_state.json", "pr_comment_sections.json"}
+
+def is_plan_input(path):
+    name = os.path.basename(path)
+    if name in NON_PLAN_FILES or name.endswith(DERIVED_SUFFIXES):
+        return False
+    return name.endswith((".json", ".tfplan"))
+
+def find_plans(patterns):
+    """Expand files, directories and glob patterns into plan files, in order and without duplicates"""
+    found = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths = sorted(glob.glob(os.path.join(pattern, "*.json")) + glob.glob(os.path.join(pattern, "*.tfplan")))
+        else:
+            paths = sorted(glob.glob(pattern, recursive=True)) or [pattern]
+        for path in paths:
+            if is_plan_input(path):
+                found.setdefault(os.path.abspath(path), None)
+    return list(found)
+
+def output_name(path):
+    name, _ = os.path.splitext(os.path.basename(path))
+    return name
+
+def place_plan_json(path, target):
+    """Make the plan JSON available as `target`, linking instead of copying when possible"""
+    if os.path.exists(target):
+        if os.path.samefile(path, target):
+            return
+        os.remove(target)
+    try:
+        os.link(path, target)
+    except OSError:
+        shutil.copyfile(path, target)
+
+def reprocess_plan(path, output_dir, j2md):
+    """Filter and render one plan into output_dir; returns (path, ok, log lines)"""
+    lines = []
+    bind_log(lines)
+    file_name = os.path.join(output_dir, output_name(path))
+    ok = True
+    try:
+        if path.endswith(".tfplan"):
+            # terraform show needs the initialized directory the plan was made in
+            show = executor.run(["terraform", "show", "-json", os.path.basename(path)], cwd=os.path.dirname(path),
+                                stdout_path=f"{file_name}.json")
+            if not show.ok:
+                return path, False, lines
+        else:
+            place_plan_json(path, f"{file_name}.json")
+
+        if j2md:
+            result = executor.run([j2md], stdin_path=f"{file_name}.json", stdout_path=f"{file_name}.md", echo=False)
+            if result.ok:
+                tfplan.process_file(f"{file_name}.md")
+            else:
+                log("Error with terraform-j2md tool")
+                ok = False
+        ok = tfplan.filter_plan_json(file_name) is not None and ok
+    except Exception as e:
+        log(f"Error reprocessing {path}: {e}")
+        ok = False
+    finally:
+        bind_log(None)
+    return path, ok, lines
+
+def write_comments(output_dir, uri, size_limit):
+    """Render the PR comment(s) for everything in output_dir to pr_comment.md (pr_comment_2.md, ...)"""
+    # Only needed here, and pulls in requests
+    from add_pr_comment import generate_comments
+    paths = []
+    for index, content in enumerate(generate_comments(uri, size_limit, directory=output_dir), start=1):
+        paths.append(os.path.join(output_dir, "pr_comment.md" if index == 1 else f"pr_comment_{index}.md"))
+        with open(paths[-1], 'w') as f:
+            f.write(content)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-run plan filtering and rendering on existing plan files.')
+    parser.add_argument('plans', nargs='+', help='Plan JSON or .tfplan files, directories or glob patterns')
+    parser.add_argument('--output', default='reprocessed', help='Folder to write the processed files to (default: reprocessed)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Plans processed in parallel (default: CPUs)')
+    parser.add_argument('--j2md', default=tfplan.TERRAFORM_J2MD,
+                        help='terraform-j2md binary; markdown is skipped when it is not installed (default: TERRAFORM_J2MD)')
+    parser.add_argument('--comment', action='store_true', help='Also render the PR comment to pr_comment.md')
+    parser.add_argument('--logs_uri', default='#', help='Build logs link shown in the PR comment')
+    parser.add_argument('--comment_size_limit', type=int, default=None,
+                        help='Split the PR comment like add_pr_comment.py does (default: one comment)')
+    args = parser.parse_args()
+
+    plans = find_plans(args.plans)
+    if not plans:
+        print("No plan files found")
+        sys.exit(1)
+    names = [output_name(path) for path in plans]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        print(f"Plans with the same name would overwrite each other: {', '.join(duplicates)}")
+        sys.exit(1)
+    os.makedirs(args.output, exist_ok=True)
+    j2md = shutil.which(args.j2md)
+    if not j2md:
+        print(f"{args.j2md} not found, skipping markdown")
+
+    failed = []
+    def finished(path, result):
+        _, ok, lines = result or (path, False, [])
+        print("\n".join([f"===== {path} ====="] + lines), flush=True)
+        if not ok:
+            failed.append(path)
+
+    postprocessor = PostProcessor(args.workers if args.workers > 1 else 0)
+    try:
+        for path in plans:
+            postprocessor.submit(reprocess_plan, (path, os.path.abspath(args.output), j2md),
+                                 lambda result, path=path: finished(path, result))
+        postprocessor.wait()
+    finally:
+        postprocessor.shutdown()
+    print(f"Reprocessed {len(plans) - len(failed)} of {len(plans)} plan(s) into {args.output}")
+
+    if args.comment:
+        for path in write_comments(args.output, args.logs_uri, args.comment_size_limit):
+            print(f"PR comment written to {path}")
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import sys
+
+# Terraform actions as bits, so an action list is one small int
+CREATE, UPDATE, DELETE, READ, NO_OP, FORGET = 1, 2, 4, 8, 16, 32
+REPLACE = CREATE | DELETE
+ACTION_BITS = {"create": CREATE, "update": UPDATE, "delete": DELETE, "read": READ, "no-op": NO_OP, "forget": FORGET}
+# create/update/delete/replace for the action sets that are counted as changes
+ACTION_NAMES = {CREATE: "create", UPDATE: "update", DELETE: "delete", REPLACE: "replace"}
+
+class ResourceChange:
+    """What the clean text, counts, risk score and summary need from one resource change.
+
+    Built from terraform's change dict once the noise rules have run, so the
+    dict with its full before/after/after_unknown/sensitive trees can be
+    dropped right away. `diff` holds the changed attributes as (path, before,
+    after) tuples: the rules' `simplified_changes` when there are any,
+    otherwise the changed top-level attributes (without tags).
+    """
+
+    __slots__ = ("address", "type", "actions", "diff", "fingerprint")
+
+    def __init__(self, address, type, actions, diff=(), fingerprint=None):
+        self.address = address
+        self.type = type
+        self.actions = actions
+        self.diff = diff
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_plan(cls, change):
+        details = change.get("change", {})
+        actions = 0
+        for action in details.get("actions", []):
+            actions |= ACTION_BITS.get(action, 0)
+        diff = ()
+        if actions in (UPDATE, REPLACE) and "before" in details and "after" in details:
+            if "simplified_changes" in details:
+                diff = tuple((path, value["before"], value["after"]) for path, value in details["simplified_changes"].items())
+            else:
+                before = details["before"] or {}
+                after = details["after"] or {}
+                diff = tuple((key, before.get(key, "null"), value) for key, value in after.items()
+                             if key != "tags" and (key not in before or before[key] != value))
+        # Type names repeat across thousands of changes, so share one string per type
+        return cls(change.get("address", "unknown"), sys.intern(change.get("type", "")), actions, diff)
+
+    @property
+    def action(self):
+        """create, update, delete or replace, or None for no-op, read and other action sets"""
+        return ACTION_NAMES.get(self.actions)
+
+    def as_summary(self):
+        """The change's entry in the plan summary JSON"""
+        return {"address": self.address, "type": self.type, "action": self.action, "fingerprint": self.fingerprint}
@@ -0,0 +1,100 @@
+import os
+import re
+import json
+from configurations.resource_types_map import resource_types
+from noise_rules import attribute_regex
+
+DEFAULT_WEIGHTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configurations", "risk_weights.json")
+
+# Emoji and ordering value of each risk level, from least to most risky
+RISK_LEVELS = {
+    "NONE": ("✅", 0),
+    "MINIMAL": ("🟢", 1),
+    "LOW": ("🟡", 2),
+    "MEDIUM": ("🟠", 3),
+    "HIGH": ("🔴", 4),
+}
+
+# Reasons kept per plan in the summary, highest points first
+MAX_REASONS = 20
+
+class PlanRisk:
+    """Running score of one plan"""
+
+    def __init__(self, scorer):
+        self.scorer = scorer
+        self.score = 0.0
+        self.reasons = []
+
+    def add(self, points, address, reason):
+        self.score += points
+        if reason:
+            self.reasons.append({"address": address, "reason": reason, "points": points})
+
+    def as_dict(self):
+        reasons = sorted(self.reasons, key=lambda reason: -reason["points"])
+        return {
+            "score": round(self.score, 1),
+            "level": self.scorer.level(self.score),
+            "reasons": reasons[:MAX_REASONS],
+            "reason_count": len(reasons),
+        }
+
+class RiskScorer:
+    """Scores resource changes by action, resource type weight, stateful types and dangerous attributes.
+
+    Every change scores its action's points times its type's weight (1 for
+    types without one). Deleting or replacing a stateful type and changing an
+    attribute matched by an attribute rule add their points on top and are
+    listed as reasons. The plan's level is the highest level whose min_score
+    the total reaches.
+    """
+
+    def __init__(self, action_points, type_weights=None, stateful_types=(), stateful_points=None,
+                 attribute_rules=(), levels=()):
+        self.action_points = action_points
+        self.type_weights = type_weights or {}
+        self.stateful_types = set(stateful_types)
+        self.stateful_points = stateful_points or {}
+        self.attribute_rules = [dict(rule, regex=re.compile(attribute_regex(rule["attribute"]) + r"\Z"))
+                                for rule in attribute_rules]
+        self.levels = sorted(levels, key=lambda level: -level["min_score"])
+        for level in self.levels:
+            if level["level"] not in RISK_LEVELS:
+                raise ValueError(f"Unknown risk level {level['level']!r}, expected one of {', '.join(RISK_LEVELS)}")
+
+    @classmethod
+    def load(cls, path=None):
+        """Load the weights file (RISK_WEIGHTS_FILE or configurations/risk_weights.json)"""
+        path = path or os.getenv("RISK_WEIGHTS_FILE") or DEFAULT_WEIGHTS_FILE
+        with open(path) as f:
+            return cls(**json.load(f))
+
+    def new_plan(self):
+        return PlanRisk(self)
+
+    def level(self, score):
+        for level in self.levels:
+            if score >= level["min_score"]:
+                return level["level"]
+        return "NONE"
+
+    def count_level(self, counts):
+        """Risk level from {action: count} alone, for summaries written without a risk score"""
+        return self.level(sum(self.action_points.get(action, 0) * count for action, count in counts.items()))
+
+    def add(self, plan, record):
+        """Score one kept resource change (a ResourceChange with an action) into plan"""
+        action = record.action
+        address = record.address
+        name = resource_types.get(record.type, record.type)
+        plan.add(self.action_points.get(action, 0) * self.type_weights.get(record.type, 1), address, None)
+
+        if record.type in self.stateful_types and action in self.stateful_points:
+            plan.add(self.stateful_points[action], address, f"{action} of stateful {name}")
+
+        for path, _, _ in record.diff:
+            for rule in self.attribute_rules:
+                if rule["regex"].match(path):
+                    plan.add(rule["points"], address, f"{rule['reason']} ({path}) on {name}")
+                    break
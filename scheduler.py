@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Per-thread log buffer. When a job runs on a worker its output is collected
+# here and printed as one block, so parallel plans don't interleave.
+_job = threading.local()
+
+def log(message):
+    """Print a message, or buffer it when called from inside a scheduled job"""
+    buffer = getattr(_job, "buffer", None)
+    if buffer is None:
+        print(message, flush=True)
+    else:
+        buffer.append(str(message))
+
+def current_log():
+    """Return the log buffer of the running job, or None outside a job"""
+    return getattr(_job, "buffer", None)
+
+def bind_log(buffer):
+    """Send this thread's log output to another job's buffer (e.g. from a reader thread)"""
+    _job.buffer = buffer
+
+def get_worker_count(cli_value=None):
+    """Resolve the worker count from the CLI flag, PLAN_WORKERS or the default of 1"""
+    value = cli_value if cli_value is not None else os.getenv("PLAN_WORKERS", "1")
+    try:
+        return max(1, int(value))
+    except ValueError:
+        raise ValueError(f"Invalid worker count: {value}")
+
+class PlanScheduler:
+    """Run directory inits and per-workspace plans on a bounded worker pool.
+
+    Every directory gets one init job; its workspace jobs wait for that init to
+    finish. Job logs are printed in submission order once each job completes.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = max(1, workers)
+        self.failed_jobs = []
+
+    def _run_job(self, name, func, args, wait_for=None):
+        _job.buffer = [f"===== {name} ====="]
+        start = time.monotonic()
+        ok = True
+        try:
+            if wait_for is not None and not wait_for.result()[0]:
+                log(f"Skipping {name}: init job failed")
+                ok = False
+            else:
+                func(*args)
+        except Exception as e:
+            log(f"Job {name} failed: {e}")
+            ok = False
+        log(f"===== {name} finished in {time.monotonic() - start:.1f}s =====")
+        lines, _job.buffer = _job.buffer, None
+        return ok, lines
+
+    def run(self, directories, init_dir, plan_workspace):
+        """Plan every (chdir, workspaces) pair.
+
+        init_dir(chdir, workspaces) runs once per directory and
+        plan_workspace(chdir, workspace) once per workspace. Returns True when
+        every job succeeded.
+        """
+        if self.workers == 1:
+            return self._run_serial(directories, init_dir, plan_workspace)
+
+        jobs = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # Submit all inits first: the pool is FIFO, so every init is picked
+            # up before any plan job blocks waiting on one.
+            init_futures = {}
+            for chdir, workspaces in directories:
+                future = pool.submit(self._run_job, f"init {chdir}", init_dir, (chdir, workspaces))
+                init_futures[chdir] = future
+                jobs.append((f"init {chdir}", future))
+            for chdir, workspaces in directories:
+                for workspace in workspaces:
+                    name = f"plan {chdir} [{workspace}]"
+                    future = pool.submit(self._run_job, name, plan_workspace, (chdir, workspace), init_futures[chdir])
+                    jobs.append((name, future))
+
+            for name, future in jobs:
+                ok, lines = future.result()
+                print("\n".join(lines), flush=True)
+                if not ok:
+                    self.failed_jobs.append(name)
+
+        return not self.failed_jobs
+
+    def _run_serial(self, directories, init_dir, plan_workspace):
+        for chdir, workspaces in directories:
+            try:
+                init_dir(chdir, workspaces)
+            except Exception as e:
+                log(f"Job init {chdir} failed: {e}")
+                self.failed_jobs.append(f"init {chdir}")
+                continue
+            for workspace in workspaces:
+                try:
+                    plan_workspace(chdir, workspace)
+                except Exception as e:
+                    log(f"Job plan {chdir} [{workspace}] failed: {e}")
+                    self.failed_jobs.append(f"plan {chdir} [{workspace}]")
+        return not self.failed_jobs
@@ -0,0 +1,227 @@
+"""Suggest how to split a large root directory into smaller, independent states.
+
+    python split_advisor.py apps__app1__prod.json --plan-seconds 640
+    python split_advisor.py apps__app1__prod.json --history .plan_history.sqlite --directory apps/app1
+
+Builds the dependency graph between the top-level modules and resources of
+the root module from the plan's `configuration` section, counts the resources
+under each of them from `resource_changes`, and groups them into parts that
+do not reference each other. Plan time is assumed to grow with the number of
+resources in the state, so each part's plan time is estimated as its share of
+the measured plan time.
+"""
+import os
+import re
+import json
+import argparse
+from collections import Counter
+
+# Units referenced by at least this share of the other units (and at least
+# MIN_HUB_DEPENDENTS) are treated as shared foundations, such as resource groups
+HUB_SHARE = 0.25
+MIN_HUB_DEPENDENTS = 3
+
+# Reference roots that are not resources or modules of the root module
+NON_UNIT_REFERENCES = ("var", "local", "each", "count", "path", "terraform", "self")
+
+_INDEX = re.compile(r"\[[^\]]*\]")
+
+def unit_of(address):
+    """Top-level module call or root resource an address belongs to, e.g. module.app for module.app.module.x.t.n[0]"""
+    parts = _INDEX.sub("", address).split(".")
+    return ".".join(parts[:3] if parts[0] == "data" else parts[:2])
+
+def reference_unit(reference):
+    """Unit a configuration reference points at, or None for variables, locals and the like"""
+    root = reference.split(".", 1)[0]
+    if root in NON_UNIT_REFERENCES or "." not in reference:
+        return None
+    return unit_of(reference)
+
+def _references(expressions):
+    """Every reference in a (nested) expressions block"""
+    if isinstance(expressions, dict):
+        for key, value in expressions.items():
+            if key == "references" and isinstance(value, list):
+                yield from value
+            else:
+                yield from _references(value)
+    elif isinstance(expressions, list):
+        for value in expressions:
+            yield from _references(value)
+
+def configuration_graph(configuration):
+    """{unit: units it references} for the resources and module calls of the root module"""
+    root = configuration.get("root_module", {})
+    graph = {}
+    for resource in root.get("resources", []):
+        unit = unit_of(resource["address"])
+        references = list(_references(resource.get("expressions", {}))) + resource.get("depends_on", [])
+        references += list(_references(resource.get("count_expression", {})))
+        references += list(_references(resource.get("for_each_expression", {})))
+        graph.setdefault(unit, set()).update(reference_unit(reference) for reference in references)
+    for name, call in root.get("module_calls", {}).items():
+        unit = f"module.{name}"
+        references = list(_references(call.get("expressions", {}))) + call.get("depends_on", [])
+        references += list(_references(call.get("count_expression", {})))
+        references += list(_references(call.get("for_each_expression", {})))
+        graph.setdefault(unit, set()).update(reference_unit(reference) for reference in references)
+    for unit, references in graph.items():
+        references.discard(None)
+        references.discard(unit)
+
+    # Every state can read the same data source, so data sources don't tie their readers together;
+    # what a data source itself references does
+    def resolve(unit, seen):
+        for reference in graph.get(unit, ()):
+            if reference.startswith("data.") and reference not in seen:
+                seen.add(reference)
+                yield from resolve(reference, seen)
+            elif not reference.startswith("data."):
+                yield reference
+    return {unit: set(resolve(unit, {unit})) - {unit} for unit in graph if not unit.startswith("data.")}
+
+def _components(units, edges):
+    """Connected components of an undirected graph, as sorted lists of units"""
+    neighbours = {unit: set() for unit in units}
+    for unit, references in edges.items():
+        for reference in references:
+            if unit in neighbours and reference in neighbours:
+                neighbours[unit].add(reference)
+                neighbours[reference].add(unit)
+    seen = set()
+    components = []
+    for unit in sorted(units):
+        if unit in seen:
+            continue
+        component, stack = [], [unit]
+        seen.add(unit)
+        while stack:
+            current = stack.pop()
+            component.append(current)
+            for neighbour in neighbours[current] - seen:
+                seen.add(neighbour)
+                stack.append(neighbour)
+        components.append(sorted(component))
+    return components
+
+def advise(configuration, resource_counts, plan_seconds=None):
+    """Split report for one plan.
+
+    `resource_counts` maps units (see unit_of) to their number of managed
+    resources. Shared units (hubs) go to their own foundation state, whose
+    outputs the other parts read through variables or data sources; the rest
+    is split into groups with no references between them.
+    """
+    graph = configuration_graph(configuration)
+    units = set(graph) | {unit for unit in resource_counts if not unit.startswith("data.")}
+    for references in graph.values():
+        units |= references
+    dependents = Counter(reference for references in graph.values() for reference in references)
+    threshold = max(MIN_HUB_DEPENDENTS, HUB_SHARE * len(units))
+    hubs = sorted(unit for unit, count in dependents.items() if count >= threshold)
+    total = sum(resource_counts.values())
+
+    def part(units_in_part, name):
+        resources = sum(resource_counts.get(unit, 0) for unit in units_in_part)
+        share = resources / total if total else 0.0
+        return {
+            "name": name,
+            "units": units_in_part,
+            "resources": resources,
+            "share": round(share, 3),
+            "estimated_plan_seconds": round(plan_seconds * share, 1) if plan_seconds is not None else None,
+        }
+
+    groups = _components(units - set(hubs), graph)
+    parts = [part(group, group[0] if len(group) == 1 else f"{group[0]} (+{len(group) - 1})") for group in groups]
+    parts.sort(key=lambda item: -item["resources"])
+    if hubs:
+        parts.insert(0, part(hubs, "shared foundation"))
+
+    largest = max((item["share"] for item in parts), default=1.0)
+    return {
+        "total_resources": total,
+        "plan_seconds": plan_seconds,
+        "shared": [{"unit": hub, "dependents": dependents[hub], "resources": resource_counts.get(hub, 0)} for hub in hubs],
+        "parts": parts,
+        # Parts planned in parallel take as long as the biggest one
+        "largest_share": largest,
+        "estimated_reduction": round(1 - largest, 3) if len(parts) > 1 else 0.0,
+        "units": [{"unit": unit, "resources": count} for unit, count in resource_counts.most_common()],
+    }
+
+def render_markdown(report, title):
+    lines = [f"# State split report: {title}", ""]
+    seconds = report["plan_seconds"]
+    lines.append(f"{report['total_resources']} resources" + (f", plan took {seconds:.0f}s" if seconds is not None else "") + ".")
+    if len(report["parts"]) <= 1:
+        lines.append("")
+        lines.append("No independent parts found: every module and resource is connected through references.")
+        return "\n".join(lines) + "\n"
+
+    lines.append(f"Could be split into {len(report['parts'])} states; planned in parallel, the longest would take "
+                 f"{report['largest_share'] * 100:.0f}% of the current plan time "
+                 f"(about {report['estimated_reduction'] * 100:.0f}% less).")
+    if report["shared"]:
+        lines += ["", "Shared units, referenced by many others and best kept in a foundation state:", ""]
+        lines += [f"- `{hub['unit']}` ({hub['dependents']} dependents, {hub['resources']} resources)" for hub in report["shared"]]
+    lines += ["", "| Part | Units | Resources | Share | Estimated plan time |", "|------|-------|-----------|-------|---------------------|"]
+    for item in report["parts"]:
+        estimate = f"{item['estimated_plan_seconds']:.0f}s" if item["estimated_plan_seconds"] is not None else "-"
+        lines.append(f"| {item['name']} | {len(item['units'])} | {item['resources']} | {item['share'] * 100:.0f}% | {estimate} |")
+    return "\n".join(lines) + "\n"
+
+def write_report(file_name, report, title):
+    """Write {file_name}_split.json and {file_name}_split.md, returning the markdown path"""
+    with open(f"{file_name}_split.json", 'w') as f:
+        json.dump(report, f, indent=2)
+    with open(f"{file_name}_split.md", 'w') as f:
+        f.write(render_markdown(report, title))
+    return f"{file_name}_split.md"
+
+def analyze_plan_file(path, plan_seconds=None):
+    """Split report for a plan JSON file, read in one pass without decoding the state"""
+    from plan_stream import PlanReader
+    configuration = {}
+    counts = Counter()
+    with open(path) as f:
+        reader = PlanReader(f)
+        for key in reader.keys():
+            if key == "configuration":
+                configuration = reader.read_value()
+            elif key == "resource_changes":
+                for change in reader.iter_array():
+                    if change.get("mode", "managed") == "managed":
+                        counts[unit_of(change.get("address", ""))] += 1
+            else:
+                reader.skip_value()
+    return advise(configuration, counts, plan_seconds)
+
+def main():
+    parser = argparse.ArgumentParser(description='Suggest how to split a root directory into smaller states from its plan JSON.')
+    parser.add_argument('plan', help='Plan JSON file (terraform show -json)')
+    parser.add_argument('--plan-seconds', type=float, help='Measured terraform plan time of the directory')
+    parser.add_argument('--history', help='Plan history database to take the average plan time from (with --directory)')
+    parser.add_argument('--directory', help='Directory of the plan in the plan history')
+    args = parser.parse_args()
+
+    plan_seconds = args.plan_seconds
+    if plan_seconds is None and args.history and args.directory:
+        from plan_history import PlanHistory
+        history = PlanHistory(args.history)
+        try:
+            for directory, _, average, _ in history.slowest_directories(limit=1000):
+                if directory == args.directory:
+                    plan_seconds = average
+        finally:
+            history.close()
+
+    file_name, _ = os.path.splitext(args.plan)
+    report = analyze_plan_file(args.plan, plan_seconds)
+    title = args.directory or os.path.basename(file_name)
+    write_report(file_name, report, title)
+    print(render_markdown(report, title))
+
+if __name__ == "__main__":
+    main()
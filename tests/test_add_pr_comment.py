@@ -0,0 +1,42 @@
+import add_pr_comment
+from add_pr_comment import budget_sections, pack_sections, render_section, DETAIL_FULL
+
+def file_summary(name, content, risk_value=1):
+    return {
+        'item': f"{name}_clean.txt",
+        'file_name': name,
+        'risk_emoji': "🟡",
+        'risk_value': risk_value,
+        'changes': [('update', f"azurerm_resource_group.{name}")],
+        'risk_reasons': [],
+        'plan_summary': "Plan: 0 to add, 1 to change, 0 to destroy.",
+        'content': content,
+    }
+
+def test_section_larger_than_primary_opens_continuation():
+    comments, overflow = pack_sections(["x" * 9500], 8000, 12000)
+    assert comments == [[], ["x" * 9500]]
+    assert not overflow
+
+def test_large_section_keeps_details_in_spare_continuation_comments():
+    summary = file_summary("apps__app1__prod", "~ resource\n" * 850)
+    full = render_section(summary, DETAIL_FULL)
+    assert 8000 < len(full) < 12000
+
+    comments = budget_sections([summary], 8000, 12000, 5)
+    assert comments == [[], [full]]
+
+def test_large_section_is_truncated_to_continuation_capacity():
+    summary = file_summary("apps__app1__prod", "~ resource\n" * 2000)
+    comments = budget_sections([summary], 8000, 12000, 5)
+    assert len(comments) == 2 and comments[0] == []
+    assert len(comments[1][0]) <= 12000
+    assert "truncated" in comments[1][0]
+
+def test_generate_comments_keeps_details_of_large_plan(tmp_path):
+    for name in ("apps__app1__prod", "apps__app2__prod"):
+        body = "".join(f"  # azurerm_app_setting.s{i} will be updated in-place\n" for i in range(200))
+        (tmp_path / f"{name}_clean.txt").write_text(f"Terraform Plan\nPlan: 0 to add, 200 to change, 0 to destroy.\n{body}")
+    comments = add_pr_comment.generate_comments("#", 20000, directory=str(tmp_path))
+    assert all(len(comment) <= 20000 for comment in comments)
+    assert "Click to expand filtered plan details" in "".join(comments)
@@ -1,20 +1,63 @@
 import os
+import re
 import sys
+import gzip
 import json
+import hashlib
+import shutil
+import argparse
+import tempfile
+import threading
+from io import StringIO
+from collections import Counter
 from glob import glob
+import executor
+import instrumentation
 from configurations.resource_types_map import resource_types
+from executor import append_line, sync_dir_contents, sync_file
+from init_cache import InitCache
+from instrumentation import StageRecorder
+from module_index import ModuleIndex
+from noise_rules import DEFAULT_RULES_FILE, NoiseRules
+from plan_cache import PlanCache, processing_key
+from plan_history import PlanHistory
+from plan_stream import PlanReader
+from postprocess import PostProcessor, get_postprocess_workers
+from resource_change import ResourceChange
+from risk import DEFAULT_WEIGHTS_FILE, RiskScorer
+from split_advisor import advise, unit_of, write_report
+from scheduler import PlanScheduler, bind_log, current_log, get_worker_count, log
 
 PROD_ENV = os.getenv("PROD_ENV").split(',') if os.getenv("PROD_ENV") else []
 UAT_ENV = os.getenv("UAT_ENV").split(',') if os.getenv("UAT_ENV") else []
 ROOT_DIRS = os.getenv("ROOT_DIRS").split(',') if os.getenv("ROOT_DIRS") else []
 
-if not PROD_ENV or not UAT_ENV or not ROOT_DIRS:
-    raise ValueError("Environment variables PROD_ENV, UAT_ENV, and ROOT_DIRS must be set and non-empty.")
-
 artifact_folder = os.getenv("ARTIFACT_FOLDER", "default_artifact_folder")
+module_index_file = os.getenv("MODULE_INDEX_FILE", os.path.join(artifact_folder, ".module_index.json"))
+TERRAFORM_J2MD = os.getenv("TERRAFORM_J2MD", "/root/go/bin/terraform-j2md")
 tf_path = os.getenv("TF_PATH", "default_tf_path")
+# json (one document, one resource change per line), ndjson (resource changes only) or none
+CLEAN_JSON_FORMAT = os.getenv("CLEAN_JSON_FORMAT", "json")
+CLEAN_JSON_GZIP = os.getenv("CLEAN_JSON_GZIP", "").lower() in ("1", "true", "yes")
+# Top-level plan sections left out of the clean JSON, e.g. prior_state,configuration,planned_values
+CLEAN_JSON_EXCLUDE = set(filter(None, os.getenv("CLEAN_JSON_EXCLUDE", "").split(",")))
+# Fail the build when a plan's risk score exceeds this (unset: never)
+RISK_SCORE_LIMIT = float(os.getenv("RISK_SCORE_LIMIT")) if os.getenv("RISK_SCORE_LIMIT") else None
+# Write a state split report for plans with at least this many resources (unset: never)
+SPLIT_ANALYSIS_MIN_RESOURCES = int(os.getenv("SPLIT_ANALYSIS_MIN_RESOURCES")) if os.getenv("SPLIT_ANALYSIS_MIN_RESOURCES") else None
 dirs_for_apply = []
+dirs_lock = threading.Lock()
 fail_build = False
+plan_cache = None
+init_cache = None
+plan_history = None
+recorder = StageRecorder()
+# Loaded once from NOISE_RULES_FILE or configurations/noise_rules.json
+noise_rules = NoiseRules.load()
+# Loaded once from RISK_WEIGHTS_FILE or configurations/risk_weights.json
+risk_scorer = RiskScorer.load()
+postprocessor = PostProcessor()
+provider_versions = {}
 
 """ reason = "$(Build.Reason)"
 if reason == "PullRequest":
@@ -22,250 +65,295 @@ if reason == "PullRequest":
 else:
   branch = "$(Build.SourceBranch)" """
 
-def run_cmd(command):
+def run_cmd(args, ok_codes=(0,), **kwargs):
+  """Run a command through the executor and fail the build on an exit code not in ok_codes"""
   global fail_build
-  print(f"Running command {command}. Output:")
-  p = os.popen(command)
-  output = (p.readlines())
-  exit_status = p.close()
-  if (exit_status):
+  result = instrumentation.record_command(executor.run(args, **kwargs))
+  log(f"Exit code {result.returncode} after {result.duration:.1f}s ({result.stdout_bytes} bytes stdout, {result.stderr_bytes} bytes stderr)")
+  if result.returncode not in ok_codes:
     fail_build = True
-  #print(output)
-  return output
+  return result
 
 def get_paths_for_tfplan():
-  print("Check for changed files")
-  files = run_cmd("git diff --name-only --relative --diff-filter AMR HEAD^ HEAD .")
+  """Root directories to plan: those with changed files plus every root using a changed module"""
+  log("Check for changed files")
+  files = [line.strip() for line in run_cmd(["git", "diff", "--name-only", "--relative", "--diff-filter", "AMR", "HEAD^", "HEAD", "."]) if line.strip()]
+  head = "".join(run_cmd(["git", "rev-parse", "HEAD"])).strip()
+
+  index = ModuleIndex.load(module_index_file, ROOT_DIRS, head)
+  index.save(module_index_file, head)
   app_paths = []
-  for file in files:
-    file_path = file.rstrip().split("/")
-    if "template" in file_path:
-      continue
-    print(file_path)
-    if file_path[-1].split(".")[1] in ["tf", "tfvars"] and file_path[:-1] not in app_paths:
-      app_paths.append(file_path[:-1])
+  for root in sorted(index.affected_roots(files)):
+    log(f"Planning {root}")
+    app_paths.append(root.split("/"))
   return app_paths
 
-def process_file(file_path):
-  # Read the lines from the file
-  with open(file_path, 'r') as infile:
-    lines = infile.readlines()
+def compile_resource_type_pattern(types):
+  """Build one regex matching any resource type as a whole word, longest name first.
+
+  Longest-first alternation makes azurerm_linux_web_app_slot win over its
+  azurerm_linux_web_app prefix regardless of the order of the type map.
+  """
+  alternation = "|".join(re.escape(resource_type) for resource_type in sorted(types, key=len, reverse=True))
+  return re.compile(rf"(?<![A-Za-z0-9_])(?:{alternation})(?![A-Za-z0-9_])")
+
+RESOURCE_TYPE_PATTERN = compile_resource_type_pattern(resource_types)
 
-  # Process the lines
-  with open(file_path, 'w') as outfile:
-    for line in lines:
+def match_resource_type(line):
+  """Return the resource type of an address in a line, or None.
+
+  The last match is used: in module.x.azurerm_redis_cache.y the type is the
+  segment right before the resource name.
+  """
+  resource_type = None
+  for match in RESOURCE_TYPE_PATTERN.finditer(line):
+    resource_type = match.group()
+  return resource_type
+
+def process_file(file_path):
+  """Label resource lines of the j2md markdown with their friendly type names"""
+  # Stream line by line into a temporary file next to the original, then swap it in
+  tmp_path = f"{file_path}.tmp"
+  with open(file_path, 'r') as infile, open(tmp_path, 'w') as outfile:
+    for line in infile:
       if line.startswith('@@'):
         continue  # Skip lines that start with "@@"
       if line.startswith('# module') or line.startswith('    - module'):
-        for resource_type in resource_types:
-          if resource_type in line:
-            if line.startswith("#"):
-              line = '# ' + resource_types[resource_type] + ":" + line[1:]
-              break
-            if line.startswith("    - module"):
-              line = '    - *' + resource_types[resource_type] + "*:" + line[5:]
-              break
-    
+        resource_type = match_resource_type(line)
+        if resource_type:
+          if line.startswith("#"):
+            line = '# ' + resource_types[resource_type] + ":" + line[1:]
+          else:
+            line = '    - *' + resource_types[resource_type] + "*:" + line[5:]
+
       outfile.write(line)  # Write the line to the file, modified or not
+  os.replace(tmp_path, file_path)
+
+def tfj2md(file_name, chdir="", env=""):
+  with recorder.stage("terraform_j2md", chdir, env):
+    run_cmd([TERRAFORM_J2MD], stdin_path=f"{file_name}.json", stdout_path=f"{file_name}.md")
+  with recorder.stage("process_file", chdir, env, python=True) as stage:
+    process_file(f"{file_name}.md")
+    stage.output_bytes = os.path.getsize(f"{file_name}.md")
+
+# ANSI color codes for Terraform-like colors
+GREEN = "\033[32m"
+RED = "\033[31m"
+YELLOW = "\033[33m"
+CYAN = "\033[36m"
+BOLD = "\033[1m"
+RESET = "\033[0m"
+GRAY = "\033[90m"
+
+def filter_resource_change(change, stats):
+  """Apply the noise rules to a single resource change.
+
+  Returns False when the change should be dropped from the clean plan. What
+  the rules matched is recorded in `stats`.
+  """
+  return noise_rules.apply(change, stats)
+
+def write_change_text(f, record):
+  """Write a single resource change in terraform plan notation"""
+  action = record.action
+  address = record.address
+
+  # Use actual terraform notation for changes with colors
+  if action == 'create':
+    prefix = f"{GREEN}+ "
+    f.write(f"\n\n{prefix}{address}{RESET}")
+  elif action == 'delete':
+    prefix = f"{RED}- "
+    f.write(f"\n\n{prefix}{address}{RESET}")
+  elif action == 'update':
+    prefix = f"{YELLOW}~ "
+    f.write(f"\n\n{prefix}{address}{RESET}")
+  elif action == 'replace':
+    prefix = f"{CYAN}-/+ "  # replacement
+    f.write(f"\n\n{prefix}{address}{RESET}")
+
+  # If it's an update, show what's changing (simplified changes, or the changed top-level attributes without tags)
+  if action == 'update':
+    for attr_path, before_value, after_value in record.diff:
+      f.write(f"\n    {YELLOW}~ {attr_path} = {before_value} -> {after_value}{RESET}")
+
+  # If it's a replacement, show that resources will be destroyed and recreated
+  if action == 'replace':
+    f.write(f"\n    {CYAN}# This resource will be destroyed and then recreated{RESET}")
+
+# Count keys used in the plan summary for each action
+ACTION_COUNT_KEYS = {'create': 'add', 'update': 'change', 'delete': 'delete', 'replace': 'replace'}
+
+def clean_json_file(file_name):
+  """Path of the clean JSON artifact in the configured format, or None when it is turned off"""
+  if CLEAN_JSON_FORMAT == "none":
+    return None
+  return f"{file_name}_clean.{CLEAN_JSON_FORMAT}" + (".gz" if CLEAN_JSON_GZIP else "")
 
-def tfj2md(file_name):
-  run_cmd(f"cat {file_name}.json | /root/go/bin/terraform-j2md > {file_name}.md")
-  process_file(f"{file_name}.md")
+def open_clean_json(path):
+  if path is None:
+    return open(os.devnull, 'w')
+  if path.endswith(".gz"):
+    return gzip.open(path, 'wt', compresslevel=6)
+  return open(path, 'w')
+
+def write_clean_text_header(f, ignored_lines, counts):
+  f.write(f"Terraform Plan (filtered - no tags or alerts)")
+
+  # Add information about ignored changes
+  if ignored_lines:
+    f.write(f"\n{GRAY}Ignored changes:{RESET}")
+    for line in ignored_lines:
+      f.write(f"\n{GRAY}  - {line}{RESET}")
+
+  f.write(f"\n\nPlan: {GREEN}{counts['add']} to add{RESET}, {YELLOW}{counts['change']} to change{RESET}, {RED}{counts['delete']} to destroy{RESET}, {CYAN}{counts['replace']} to replace{RESET}")
+
+def write_no_changes(file_name):
+  """Write the clean text and summary of a plan terraform reported as unchanged, without reading its JSON"""
+  counts = {'add': 0, 'change': 0, 'delete': 0, 'replace': 0}
+  with open(f"{file_name}_clean.txt", 'w') as f:
+    write_clean_text_header(f, [], counts)
+    f.write(f"\n\n{GRAY}No changes to show after filtering.{RESET}")
+  with open(f"{file_name}_summary.json", 'w') as f:
+    json.dump({'counts': counts, 'changes': [], 'ignored': {}, 'no_changes': True}, f)
+
+def filter_plan_json(file_name, plan_seconds=None):
+  """Create a filtered version of the Terraform plan JSON without the noise matched by the rules.
+
+  The plan is streamed: resource_changes are decoded one at a time and every
+  other top-level section is copied through to the clean JSON undecoded, so
+  memory is bounded by the largest single resource change. Counts, the clean
+  JSON, the clean text and the machine-readable summary used by the PR
+  comment all come out of the same pass. Sections in CLEAN_JSON_EXCLUDE are
+  skipped, and the ndjson format writes only the resource changes. With
+  SPLIT_ANALYSIS_MIN_RESOURCES set, the configuration section is also decoded
+  for the state split report of large plans.
+  """
+  clean_output_file = clean_json_file(file_name)
+  whole_document = CLEAN_JSON_FORMAT == "json"
+  ndjson = CLEAN_JSON_FORMAT == "ndjson"
+  clean_text_file = f"{file_name}_clean.txt"
+  summary_file = f"{file_name}_summary.json"
+  stats = noise_rules.new_stats()
+  risk = risk_scorer.new_plan()
+  counts = {'add': 0, 'change': 0, 'delete': 0, 'replace': 0}
+  summary_changes = []
+  has_changes = False
+  split_analysis = SPLIT_ANALYSIS_MIN_RESOURCES is not None
+  configuration = {}
+  unit_counts = Counter()
 
-def filter_plan_json(file_name):
-  """Create a filtered version of the Terraform plan JSON without tags and alerts"""
   try:
-    with open(f"{file_name}.json", 'r') as f:
-      plan_data = json.load(f)
-      
-    # Filter out resources with tags or alerts
-    if 'resource_changes' in plan_data:
-      filtered_changes = []
-      coralogix_alerts = set()  # To track unique alert names
-      tag_block_changes = 0
-      tag_only_changes = 0
-      
-      for change in plan_data['resource_changes']:
-        # Track Coralogix alerts by their unique name
-        if change.get('type', '') == 'coralogix_alert' or 'coralogix_alert' in change.get('address', ''):
-          # Extract alert name from address (last part after the dot or bracket)
-          alert_name = change.get('address', '').split('.')[-1]
-          if '[' in alert_name:
-            alert_name = alert_name.split('[')[0]  # Handle indexed resources
-          coralogix_alerts.add(alert_name)
+    # Resource lines go to a temporary file because the header (ignored
+    # changes and counts) is only known once the whole plan has been read
+    with open(f"{file_name}.json", 'r') as infile, \
+         open_clean_json(clean_output_file) as json_out, \
+         tempfile.TemporaryFile('w+') as body:
+      reader = PlanReader(infile)
+      if whole_document:
+        json_out.write("{")
+      sections = 0
+      is_plan = False
+      for key in reader.keys():
+        # terraform leaves resource_changes out of plans without resources, format_version is always there
+        is_plan = is_plan or key in ('resource_changes', 'format_version')
+        if key != 'resource_changes':
+          copy = whole_document and key not in CLEAN_JSON_EXCLUDE
+          if copy:
+            json_out.write(("," if sections else "") + f"\n{json.dumps(key)}: ")
+            sections += 1
+          if split_analysis and key == 'configuration':
+            raw = StringIO()
+            reader.copy_value(raw)
+            configuration = json.loads(raw.getvalue())
+            if copy:
+              json_out.write(raw.getvalue())
+          elif copy:
+            reader.copy_value(json_out)
+          else:
+            reader.skip_value()
           continue
-        
-        # Check if this change affects tags
-        has_tag_changes = False
-        other_changes = False
-        
-        if change.get('change', {}).get('actions', []) == ['update']:
-          before = change.get('change', {}).get('before', {})
-          after = change.get('change', {}).get('after', {})
-          
-          # Check if tags are changing
-          if 'tags' in after or 'tags' in before:
-            if before.get('tags', {}) != after.get('tags', {}):
-              has_tag_changes = True
-              tag_block_changes += 1
-          
-          # Check if there are other changes besides tags
-          before_no_tags = {k: v for k, v in before.items() if k != 'tags'}
-          after_no_tags = {k: v for k, v in after.items() if k != 'tags'}
-          
-          if before_no_tags != after_no_tags:
-            other_changes = True
-            
-            # If we're updating complex objects, find only the changed attributes
-            if change.get('change', {}).get('before_sensitive') == change.get('change', {}).get('after_sensitive'):
-              # Only process for non-sensitive changes to avoid security issues
-              simplified_changes = {}
-              
-              # Identify which top-level keys have changed
-              for key in before_no_tags:
-                if key in after_no_tags and before_no_tags[key] != after_no_tags[key]:
-                  # If the value is a nested structure (dict or list), try to pinpoint specific changes
-                  if isinstance(before_no_tags[key], (dict, list)) and isinstance(after_no_tags[key], (dict, list)):
-                    # For nested objects, create a simplified representation
-                    # Store only the key with a note that it changed
-                    simplified_changes[key] = f"[Complex value changed]"
-                  else:
-                    # For simple values, store the before and after
-                    simplified_changes[key] = {
-                      "before": before_no_tags[key],
-                      "after": after_no_tags[key]
-                    }
-              
-              # Replace the full before/after with simplified changes when appropriate
-              if simplified_changes and 'change' in change:
-                change['change']['simplified_changes'] = simplified_changes
-            
-          # If only tags are changing, count it as a tag-only change
-          if has_tag_changes and not other_changes:
-            tag_only_changes += 1
+
+        # Filter out noise (alerts, tags, ...) according to the rules
+        if whole_document:
+          json_out.write(("," if sections else "") + f"\n{json.dumps(key)}: [")
+          sections += 1
+        written = 0
+        total = 0
+        for change in reader.iter_array():
+          total += 1
+          if split_analysis and change.get('mode', 'managed') == 'managed':
+            unit_counts[unit_of(change.get('address', ''))] += 1
+          if not filter_resource_change(change, stats):
             continue
-            
-        # Filter out tags
-        if 'change' in change and 'after' in change['change']:
-          # Remove tags if present
-          if isinstance(change['change']['after'], dict) and 'tags' in change['change']['after']:
-            del change['change']['after']['tags']
-              
-        filtered_changes.append(change)
-          
-      plan_data['resource_changes'] = filtered_changes
-        
-    # Write the filtered plan data to a clean JSON file
-    clean_output_file = f"{file_name}_clean.json"
-    with open(clean_output_file, 'w') as f:
-      json.dump(plan_data, f, indent=2)
-      
-    # ANSI color codes for Terraform-like colors
-    GREEN = "\033[32m"
-    RED = "\033[31m"
-    YELLOW = "\033[33m"
-    CYAN = "\033[36m"
-    BOLD = "\033[1m"
-    RESET = "\033[0m"
-    GRAY = "\033[90m"
-      
-    # Convert the filtered JSON to text format that looks like terraform plan output
-    clean_text_file = f"{file_name}_clean.txt"
-    with open(clean_text_file, 'w') as f:
-      f.write(f"Terraform Plan (filtered - no tags or alerts)")
-      
-      # Add information about ignored changes
-      if coralogix_alerts or tag_block_changes > 0:
-        f.write(f"\n{GRAY}Ignored changes:{RESET}")
-        if coralogix_alerts:
-          f.write(f"\n{GRAY}  - {len(coralogix_alerts)} unique Coralogix alerts{RESET}")
-        if tag_block_changes > 0:
-          f.write(f"\n{GRAY}  - {tag_block_changes} tag blocks changing ({tag_only_changes} tag-only changes){RESET}")
-      
-      # Count resources changes
-      add_count = sum(1 for change in plan_data.get('resource_changes', []) 
-                     if change.get('change', {}).get('actions', []) == ['create'])
-      change_count = sum(1 for change in plan_data.get('resource_changes', []) 
-                        if change.get('change', {}).get('actions', []) == ['update'])
-      delete_count = sum(1 for change in plan_data.get('resource_changes', []) 
-                        if change.get('change', {}).get('actions', []) == ['delete'])
-      replace_count = sum(1 for change in plan_data.get('resource_changes', []) 
-                         if sorted(change.get('change', {}).get('actions', [])) == sorted(['create', 'delete']))
-      
-      f.write(f"\n\nPlan: {GREEN}{add_count} to add{RESET}, {YELLOW}{change_count} to change{RESET}, {RED}{delete_count} to destroy{RESET}, {CYAN}{replace_count} to replace{RESET}")
-      
-      # Only show resources with actual changes
-      has_changes = False
-      
-      # Write resource changes in terraform format
-      for change in plan_data.get('resource_changes', []):
-        actions = change.get('change', {}).get('actions', [])
-        
-        # Skip resources with no actions (untouched)
-        if not actions:
-          continue
-          
-        has_changes = True
-        address = change.get('address', 'unknown')
-        
-        # Use actual terraform notation for changes with colors
-        if actions == ['create']:
-          prefix = f"{GREEN}+ "
-          f.write(f"\n\n{prefix}{address}{RESET}")
-        elif actions == ['delete']:
-          prefix = f"{RED}- "
-          f.write(f"\n\n{prefix}{address}{RESET}")
-        elif actions == ['update']:
-          prefix = f"{YELLOW}~ "
-          f.write(f"\n\n{prefix}{address}{RESET}")
-        elif sorted(actions) == sorted(['create', 'delete']):
-          prefix = f"{CYAN}-/+ "  # replacement
-          f.write(f"\n\n{prefix}{address}{RESET}")
-        
-        # If it's an update, show what's changing (excluding tags)
-        if actions == ['update'] and 'before' in change.get('change', {}) and 'after' in change.get('change', {}):
-          before = change['change']['before']
-          after = change['change']['after']
-          
-          # If we have simplified changes, use those instead of the full diff
-          if 'simplified_changes' in change.get('change', {}):
-            simplified = change['change']['simplified_changes']
-            for key, value in simplified.items():
-              if isinstance(value, dict) and 'before' in value and 'after' in value:
-                # For simple values that changed
-                f.write(f"\n    {YELLOW}~ {key} = {value['before']} -> {value['after']}{RESET}")
-              else:
-                # For complex values, just indicate they changed
-                # Try to extract relevant parts for common patterns
-                if key == 'site_config' and isinstance(before.get('site_config'), list) and isinstance(after.get('site_config'), list):
-                  # For site_config, try to show only what changed
-                  before_config = before.get('site_config', [{}])[0] if before.get('site_config') else {}
-                  after_config = after.get('site_config', [{}])[0] if after.get('site_config') else {}
-                  
-                  for config_key in set(list(before_config.keys()) + list(after_config.keys())):
-                    if config_key in before_config and config_key in after_config and before_config[config_key] != after_config[config_key]:
-                      f.write(f"\n    {YELLOW}~ {key}.{config_key} = {before_config[config_key]} -> {after_config[config_key]}{RESET}")
-                else:
-                  f.write(f"\n    {YELLOW}~ {key} = [Complex value changed]{RESET}")
-          else:
-            # Fall back to showing all differences
-            for key, after_value in after.items():
-              if key != 'tags' and (key not in before or before[key] != after_value):
-                before_value = before.get(key, 'null')
-                f.write(f"\n    {YELLOW}~ {key} = {before_value} -> {after_value}{RESET}")
-        
-        # If it's a replacement, show that resources will be destroyed and recreated
-        if sorted(actions) == sorted(['create', 'delete']):
-          f.write(f"\n    {CYAN}# This resource will be destroyed and then recreated{RESET}")
-        
-      # If no changes after filtering, indicate that
-      if not has_changes:
-        f.write(f"\n\n{GRAY}No changes to show after filtering.{RESET}")
-            
+          if whole_document:
+            json_out.write(("," if written else "") + "\n" + json.dumps(change, separators=(',', ':')))
+          elif ndjson:
+            json_out.write(json.dumps(change, separators=(',', ':')) + "\n")
+          written += 1
+
+          # Keep only the compact record, so the raw before/after trees are freed now
+          record = ResourceChange.from_plan(change)
+          change = None
+
+          # Only show resources with actual changes, skip untouched ones
+          text = ""
+          if record.actions:
+            has_changes = True
+            text_out = StringIO()
+            write_change_text(text_out, record)
+            text = text_out.getvalue()
+            body.write(text)
+
+          # Count resources changes
+          action = record.action
+          if action:
+            counts[ACTION_COUNT_KEYS[action]] += 1
+            risk_scorer.add(risk, record)
+            # Same text means the same change, so the PR comment can show it once for all workspaces
+            record.fingerprint = hashlib.sha1(text.encode()).hexdigest()[:16]
+            # The diff has been rendered and scored, the summary only needs the record's identity
+            record.diff = ()
+            summary_changes.append(record)
+        if whole_document:
+          json_out.write("\n]")
+        instrumentation.note(resource_changes=total)
+      if not is_plan:
+        raise ValueError(f"{file_name}.json is not a terraform plan, it has no resource_changes")
+      if whole_document:
+        json_out.write("\n}\n")
+
+      # Convert the filtered JSON to text format that looks like terraform plan output
+      with open(clean_text_file, 'w') as f:
+        write_clean_text_header(f, stats.summary_lines(), counts)
+
+        body.seek(0)
+        shutil.copyfileobj(body, f)
+
+        # If no changes after filtering, indicate that
+        if not has_changes:
+          f.write(f"\n\n{GRAY}No changes to show after filtering.{RESET}")
+
+    # Compact summary so the PR comment doesn't have to parse the text output
+    with open(summary_file, 'w') as f:
+      json.dump({
+        'counts': counts,
+        'changes': [record.as_summary() for record in summary_changes],
+        'ignored': stats.as_dict(),
+        'risk': risk.as_dict(),
+      }, f)
+
+    if split_analysis and sum(unit_counts.values()) >= SPLIT_ANALYSIS_MIN_RESOURCES:
+      report = write_report(file_name, advise(configuration, unit_counts, plan_seconds), os.path.basename(file_name))
+      log(f"State split report written to {report}")
+
   except Exception as e:
-    print(f"Error filtering plan JSON: {e}")
+    log(f"Error filtering plan JSON: {e}")
+    # Don't leave a truncated clean JSON behind for the PR comment or the cache to pick up
+    if clean_output_file and os.path.exists(clean_output_file):
+      os.remove(clean_output_file)
     return None
-    
+
   return clean_text_file
 
 #def infracost(file_name):
@@ -276,66 +364,272 @@ def filter_plan_json(file_name):
 #  run_cmd(f"infracost diff --path {file_name}.json >> {file_name}.md")
 #  run_cmd(f"echo -e '````````\n</details>' >> {file_name}.md")
 
-def tfplan(chdir, env):
-  file_name = chdir.replace("/","__") + "__" + env
-  workspace_exists = run_cmd(f"terraform -chdir=./{chdir} workspace list | grep '\s{env}$'")
-  if not workspace_exists:
-    run_cmd(f"terraform -chdir=./{chdir} workspace new {env}")
-  else:
-    run_cmd(f"terraform -chdir=./{chdir} workspace select {env}")
-  run_cmd(f"terraform -chdir=./{chdir} plan -var-file={env}.tfvars -out {env}.tfplan -lock=false > {file_name}.txt")
-  run_cmd(f"terraform -chdir=./{chdir} show -json {env}.tfplan > {file_name}.json")
-  run_cmd(f"cp -r {chdir}/* {artifact_folder}/{chdir}")
+def init_dir(chdir, workspaces):
+  """Run terraform init and create any missing workspaces for a directory"""
+  os.makedirs(f"{artifact_folder}/{chdir}", exist_ok=True)
+  with recorder.stage("init", chdir):
+    if init_cache.is_fresh(chdir):
+      log(f"Skipping init for {chdir}: lock file and backend config unchanged since the last init")
+      init_cache.record(chdir, 0, skipped=True)
+    else:
+      with init_cache.lock:
+        result = run_cmd(["terraform", f"-chdir=./{chdir}", "init"], env=init_cache.env())
+      init_cache.record(chdir, result.duration, skipped=False)
+      if result.ok:
+        init_cache.mark(chdir)
+
+  # Workspaces are created up front so the parallel plan jobs only need
+  # TF_WORKSPACE and never touch the shared .terraform/environment file
+  with recorder.stage("workspace_select", chdir):
+    existing = [line.strip().lstrip("* ") for line in run_cmd(["terraform", f"-chdir=./{chdir}", "workspace", "list"])]
+    for env in workspaces:
+      if env not in existing:
+        run_cmd(["terraform", f"-chdir=./{chdir}", "workspace", "new", env])
+
+  # Provider selections are part of the plan cache key
+  if plan_cache and plan_cache.enabled:
+    provider_versions[chdir] = "".join(run_cmd(["terraform", f"-chdir=./{chdir}", "version", "-json"]))
+
+# Modules that turn a plan into the cached artifacts, next to this file
+PROCESSING_MODULES = ("tfplan.py", "noise_rules.py", "risk.py", "resource_change.py", "plan_diff.py", "plan_stream.py",
+                      os.path.join("configurations", "resource_types_map.py"))
+
+def plan_processing_key():
+  """Plan cache key part for the code, rules, weights and settings the cached artifacts were made with"""
+  here = os.path.dirname(os.path.abspath(__file__))
+  paths = [os.path.join(here, name) for name in PROCESSING_MODULES]
+  paths += [os.getenv("NOISE_RULES_FILE") or DEFAULT_RULES_FILE, os.getenv("RISK_WEIGHTS_FILE") or DEFAULT_WEIGHTS_FILE]
+  return processing_key(paths, f"{TERRAFORM_J2MD}\0{','.join(sorted(CLEAN_JSON_EXCLUDE))}")
 
-  if chdir not in dirs_for_apply:
-    dirs_for_apply.append(chdir)
-    run_cmd(f"echo {chdir} >> {artifact_folder}/directories.txt")
+def plan_artifacts(chdir, env, file_name):
+  """Files produced by a plan, keyed by their name in the plan cache"""
+  artifacts = {
+    "plan.txt": f"{file_name}.txt",
+    "plan.json": f"{file_name}.json",
+    "plan.md": f"{file_name}.md",
+    "clean.txt": f"{file_name}_clean.txt",
+    "summary.json": f"{file_name}_summary.json",
+    # The binary plan is what the apply stage picks up from the artifact folder
+    "plan.tfplan": f"{chdir}/{env}.tfplan",
+  }
+  clean_json = clean_json_file(file_name)
+  if clean_json:
+    # Named after the format, so entries cached in another format are not restored
+    artifacts["clean." + clean_json.split("_clean.", 1)[1]] = clean_json
+  return artifacts
 
+# Artifacts left when terraform reports no changes, which skips show, j2md and the filter
+NO_CHANGES_ARTIFACTS = ("plan.txt", "clean.txt", "summary.json", "plan.tfplan")
+
+def publish_dir(chdir, env):
+  """Sync a planned directory to the artifact folder and register it for apply.
+
+  The directory is synced once, with its first workspace; later workspaces
+  only sync their own binary plan.
+  """
+  with dirs_lock:
+    if chdir not in dirs_for_apply:
+      copied = sync_dir_contents(chdir, f"{artifact_folder}/{chdir}")
+      log(f"Synced {copied} changed file(s) of {chdir} to the artifact folder")
+      dirs_for_apply.append(chdir)
+      append_line(f"{artifact_folder}/directories.txt", chdir)
+    elif os.path.exists(f"{chdir}/{env}.tfplan"):
+      sync_file(f"{chdir}/{env}.tfplan", f"{artifact_folder}/{chdir}/{env}.tfplan")
+
+def run_tfj2md(file_name, chdir, env):
   try:
-    tfj2md(file_name)
+    tfj2md(file_name, chdir, env)
   except Exception as e:
-    print(e)
-    print("Error with terraform-j2md tool")
-  
+    log(e)
+    log("Error with terraform-j2md tool")
+
+def filter_plan_job(file_name, chdir, env, plan_seconds=None):
+  """filter_plan_json as a post-processing job, returning the clean text file, its stage and its log lines"""
+  previous, lines = current_log(), []
+  bind_log(lines)
   try:
-    filter_plan_json(file_name)
+    with recorder.stage("filter_plan_json", chdir, env, python=True) as stage:
+      clean_text_file = filter_plan_json(file_name, plan_seconds)
+      if clean_text_file:
+        stage.output_bytes = os.path.getsize(clean_text_file)
   except Exception as e:
-    print(e)
-    print("Error filtering plan JSON")
+    log(e)
+    log("Error filtering plan JSON")
+    clean_text_file = None
+  finally:
+    bind_log(previous)
+  return clean_text_file, stage, lines
+
+def read_summary(file_name):
+  try:
+    with open(f"{file_name}_summary.json") as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return None
+
+def check_risk_limit(file_name, chdir, env):
+  """Fail the build when the plan's risk score is above RISK_SCORE_LIMIT"""
+  global fail_build
+  if RISK_SCORE_LIMIT is None:
+    return
+  risk = (read_summary(file_name) or {}).get('risk')
+  if risk and risk['score'] > RISK_SCORE_LIMIT:
+    log(f"Risk score {risk['score']} ({risk['level']}) of {chdir} [{env}] is above the limit of {RISK_SCORE_LIMIT:g}")
+    for reason in risk['reasons']:
+      log(f"  {reason['reason']}: {reason['address']} (+{reason['points']:g})")
+    fail_build = True
+
+def record_history(file_name, chdir, env, plan_seconds=None, cached=False):
+  """Append the plan's summary to the plan history"""
+  if not plan_history or not plan_history.enabled:
+    return
+  summary = read_summary(file_name)
+  if summary is None:
+    return
+  json_file = f"{file_name}.json"
+  json_bytes = os.path.getsize(json_file) if os.path.exists(json_file) else None
+  try:
+    plan_history.record(chdir, env, summary, plan_seconds=plan_seconds, json_bytes=json_bytes, cached=cached)
+  except Exception as e:
+    # The history is only for trends, it must not fail the build
+    log(f"Could not record plan history for {chdir} [{env}]: {e}")
+
+def finish_filter(result, chdir, env, file_name, artifacts, cache_key, plan_seconds=None):
+  """Record a finished filter job and cache the plan if it was processed successfully"""
+  if result is None:
+    log(f"Error filtering plan JSON for {chdir} [{env}]")
+    return
+  clean_text_file, stage, lines = result
+  for line in lines:
+    log(line)
+  if not postprocessor.in_process:
+    # Measured by the pool process's own recorder
+    recorder.add(stage)
+  if clean_text_file:
+    check_risk_limit(file_name, chdir, env)
+    record_history(file_name, chdir, env, plan_seconds=plan_seconds)
+
+  # Only cache complete, successfully processed plans
+  if cache_key and clean_text_file and os.path.getsize(f"{file_name}.json") > 0:
+    plan_cache.store(cache_key, artifacts, chdir=chdir, workspace=env)
+
+def tfplan(chdir, env):
+  file_name = chdir.replace("/","__") + "__" + env
+  artifacts = plan_artifacts(chdir, env, file_name)
+  cache_key = None
+  if plan_cache and plan_cache.enabled:
+    cache_key = plan_cache.key(chdir, env, provider_versions.get(chdir, ""))
+    with recorder.stage("cache_restore", chdir, env):
+      restored = plan_cache.restore(cache_key, artifacts)
+    if restored:
+      log(f"Reusing cached plan for {chdir} [{env}] (key {cache_key[:12]})")
+      check_risk_limit(file_name, chdir, env)
+      record_history(file_name, chdir, env, cached=True)
+      publish_dir(chdir, env)
+      return
+
+  # -detailed-exitcode: 0 means no changes, 2 means changes, 1 is an error
+  workspace_env = {"TF_WORKSPACE": env}
+  with recorder.stage("plan", chdir, env):
+    plan = run_cmd(["terraform", f"-chdir=./{chdir}", "plan", f"-var-file={env}.tfvars", "-out", f"{env}.tfplan", "-lock=false",
+                    "-detailed-exitcode"], ok_codes=(0, 2), env=workspace_env, stdout_path=f"{file_name}.txt")
+  if plan.returncode == 0:
+    log(f"No changes in {chdir} [{env}], skipping post-processing")
+    write_no_changes(file_name)
+    record_history(file_name, chdir, env, plan_seconds=plan.duration)
+    publish_dir(chdir, env)
+    if cache_key:
+      plan_cache.store(cache_key, {name: artifacts[name] for name in NO_CHANGES_ARTIFACTS},
+                       chdir=chdir, workspace=env, no_changes=True)
+    return
+
+  with recorder.stage("show_json", chdir, env):
+    run_cmd(["terraform", f"-chdir=./{chdir}", "show", "-json", f"{env}.tfplan"], env=workspace_env, stdout_path=f"{file_name}.json")
+  publish_dir(chdir, env)
+
+  # The Python filter runs in the shared process pool while terraform-j2md runs
+  # here; the plan is cached once the filter is done, so in-process it goes last
+  def finished(result):
+    finish_filter(result, chdir, env, file_name, artifacts, cache_key, plan.duration)
+  if postprocessor.in_process:
+    run_tfj2md(file_name, chdir, env)
+    postprocessor.submit(filter_plan_job, (file_name, chdir, env, plan.duration), finished)
+  else:
+    postprocessor.submit(filter_plan_job, (file_name, chdir, env, plan.duration), finished)
+    run_tfj2md(file_name, chdir, env)
   
   #try:
   #  infracost(file_name)
   #except: 
   #  print("Error with infracost tool")
 
-################ MAIN ################
+def main():
+  global fail_build, plan_cache, init_cache, plan_history, recorder, postprocessor
+  parser = argparse.ArgumentParser(description='Run terraform plan for changed directories and simplify the output.')
+  parser.add_argument('--workers', type=int, help='Number of concurrent init/plan jobs (default: PLAN_WORKERS or 1)')
+  parser.add_argument('--force-init', action='store_true', help='Run terraform init even when the directory looks already initialized')
+  parser.add_argument('--profile', choices=['cprofile', 'tracemalloc'], default=os.getenv("PLAN_PROFILE") or None,
+                      help='Profile the Python processing stages (default: PLAN_PROFILE)')
+  parser.add_argument('--postprocess-workers', type=int,
+                      help='Processes for filtering plan JSON alongside the next plans; 0 filters in the job itself (default: POSTPROCESS_WORKERS or min(4, CPUs))')
+  parser.add_argument('--no-cache', action='store_true', help='Always run terraform plan, ignoring cached plans (same as PLAN_CACHE_BYPASS=1)')
+  args = parser.parse_args()
 
-print(tf_path)
-if tf_path == "tf_path":
-  print("tf_path")
-  app_paths = get_paths_for_tfplan()
-else:
-  app_paths = [tf_path.split("/")]
+  if not PROD_ENV or not UAT_ENV or not ROOT_DIRS:
+    raise ValueError("Environment variables PROD_ENV, UAT_ENV, and ROOT_DIRS must be set and non-empty.")
+  if CLEAN_JSON_FORMAT not in ("json", "ndjson", "none"):
+    raise ValueError(f"CLEAN_JSON_FORMAT must be json, ndjson or none, not {CLEAN_JSON_FORMAT!r}.")
+  recorder = StageRecorder(profile=args.profile, profile_dir=artifact_folder)
 
-# For every path that have terraform files changed
-for app_path in app_paths:
+  print(tf_path)
+  if tf_path == "tf_path":
+    print("tf_path")
+    with recorder.stage("detect_changes", python=True):
+      app_paths = get_paths_for_tfplan()
+  else:
+    app_paths = [tf_path.split("/")]
+
+  # For every path that have terraform files changed, collect the workspaces to plan
+  directories = []
+  for app_path in app_paths:
     chdir = "/".join(app_path)
     print(f"Changed dir will be: {chdir}. The current path is: {os.getcwd()}")
 
     # Gets all workspaces by the tfvars file
     workspaces = [workspace.replace(".tfvars", "").split("/")[-1] for workspace in glob(f"./{chdir}/*.tfvars")]
     print(f"workspaces: {workspaces}")
-    run_cmd(f"mkdir -p {artifact_folder}/{chdir}")
-    run_cmd(f"terraform -chdir=./{chdir} init")
-
-    # For every workspace in the app path
-    for workspace in workspaces:
     #if "main" in branch and workspace in PROD_ENV:
-        if workspace in (PROD_ENV + UAT_ENV):
-            tfplan(chdir, workspace)
-        #elif "uat" in branch and workspace in UAT_ENV:
-        #  plan(chdir, workspace)
-if (fail_build == True):
-  sys.exit(1)
-""" else:
-  print("Invalid branch, no plan required") """
+    workspaces = [workspace for workspace in workspaces if workspace in (PROD_ENV + UAT_ENV)]
+    #elif "uat" in branch and workspace in UAT_ENV:
+    #  plan(chdir, workspace)
+    directories.append((chdir, workspaces))
+
+  plan_cache = PlanCache.from_env(artifact_folder, bypass=args.no_cache, processing=plan_processing_key())
+  plan_cache.evict()
+  init_cache = InitCache.from_env(force=args.force_init)
+  plan_history = PlanHistory.from_env(artifact_folder)
+
+  # Profiles are only collected in this process, so profiling filters in the jobs themselves
+  postprocessor = PostProcessor(0 if args.profile else get_postprocess_workers(args.postprocess_workers))
+
+  scheduler = PlanScheduler(get_worker_count(args.workers))
+  try:
+    if not scheduler.run(directories, init_dir, tfplan):
+      print(f"Failed jobs: {', '.join(scheduler.failed_jobs)}")
+      fail_build = True
+    postprocessor.wait()
+  finally:
+    postprocessor.shutdown()
+    plan_history.close()
+  print("\n".join(init_cache.report()))
+  print(f"Run report written to {recorder.write_report(artifact_folder)}")
+
+  if (fail_build == True):
+    sys.exit(1)
+  """ else:
+    print("Invalid branch, no plan required") """
+
+################ MAIN ################
+
+if __name__ == "__main__":
+  main()